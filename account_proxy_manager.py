@@ -2,20 +2,69 @@
 # -*- coding: utf-8 -*-
 """
 账号代理管理器
-为每个账号分配独立的代理IP，避免账号关联
+为每个账号分配代理IP，避免账号关联；
+一个代理最多由 PROXY_ACCOUNTS_PER_PROXY 个账号共用（默认1，即每个账号独立代理）。
+
+共用代理时账号按固定分组（cohort）共用：账号第一次出现时加入一个未满的分组，
+分组编号保存在映射文件中，之后每次运行同一组账号总是共用同一个代理，不同分组之间不共用。
+固定的只是分组，代理IP本身在租约到期后必然更换，换IP时整组一起换到同一个新代理
 """
 
+import atexit
 import json
+import math
+import os
 import random
+import threading
 import time
-from typing import Dict, List, Optional
-from proxy_api import ProxyAPI
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set, Tuple
+from circuit_breaker import proxy_breakers
+from proxy_api import ProxyAPI, proxy_api as shared_proxy_api
+from proxy_config import PROXY_SAVE_INTERVAL, DebouncedSave, proxy_key, write_json_atomic
+from proxy_selector import PROXY_LEASE_MARGIN, is_lease_expired, lease_remaining
+
+# 批量分配时每次向代理API请求的代理数量
+PROXY_ASSIGN_BATCH = int(os.getenv("PROXY_ASSIGN_BATCH", "20"))
+# 一个代理最多分配给几个账号
+PROXY_ACCOUNTS_PER_PROXY = int(os.getenv("PROXY_ACCOUNTS_PER_PROXY", "1"))
+# 同一个代理上同时进行的请求数上限
+PROXY_MAX_CONCURRENT = int(os.getenv("PROXY_MAX_CONCURRENT", "2"))
 
-class AccountProxyManager:
-    def __init__(self, mapping_file: str = "account_proxy_mapping.json"):
+class AccountProxyManager(DebouncedSave):
+    def __init__(self, mapping_file: str = "account_proxy_mapping.json", proxy_api: Optional[ProxyAPI] = None,
+                 accounts_per_proxy: int = PROXY_ACCOUNTS_PER_PROXY, max_concurrent_per_proxy: int = PROXY_MAX_CONCURRENT,
+                 save_interval: float = PROXY_SAVE_INTERVAL):
+        """
+        Args:
+            mapping_file: 账号代理映射文件
+            save_interval: 请求结果（成功/失败次数）导致的变化最多延迟多久写入文件（秒）
+            proxy_api: 获取代理使用的 ProxyAPI，默认使用全局共享实例（与 proxy_config.proxy_manager 同一个代理池）
+            accounts_per_proxy: 一个代理最多分配给几个账号
+            max_concurrent_per_proxy: 同一个代理上同时进行的请求数上限
+        """
         self.mapping_file = mapping_file
-        self.proxy_api = ProxyAPI()
+        self.save_interval = save_interval
+        self.proxy_api = proxy_api or shared_proxy_api
+        self.accounts_per_proxy = max(1, accounts_per_proxy)
+        self.max_concurrent_per_proxy = max(1, max_concurrent_per_proxy)
         self.account_proxy_map = self.load_mapping()
+        # 多个工作线程同时读写映射时加锁
+        self._lock = threading.RLock()
+        # 代理 (ip, port) -> 使用该代理的账号
+        self._sharers: Dict[Tuple[str, str], Set[str]] = {}
+        # 账号 -> 共用分组编号，分组编号 -> 组内账号
+        self._cohorts: Dict[str, int] = {}
+        self._members: Dict[int, Set[str]] = {}
+        for account, proxy_info in self.account_proxy_map.items():
+            self._sharers.setdefault(proxy_key(proxy_info), set()).add(account)
+            if proxy_info.get('cohort') is not None:
+                self._cohorts[account] = proxy_info['cohort']
+                self._members.setdefault(proxy_info['cohort'], set()).add(account)
+        self._semaphores: Dict[Tuple[str, str], threading.BoundedSemaphore] = {}
+        # 映射代理熔断期间临时借用的代理：账号 -> 代理，不写入映射
+        self._borrowed: Dict[str, Dict] = {}
+        atexit.register(self.flush)
     
     def load_mapping(self) -> Dict:
         """加载账号代理映射"""
@@ -24,38 +73,138 @@ class AccountProxyManager:
                 return json.load(f)
         except FileNotFoundError:
             return {}
+        except Exception as e:
+            print(f"加载账号代理映射失败: {e}")
+            return {}
     
     def save_mapping(self):
-        """保存账号代理映射"""
-        with open(self.mapping_file, 'w', encoding='utf-8') as f:
-            json.dump(self.account_proxy_map, f, ensure_ascii=False, indent=2)
+        """保存账号代理映射（先写临时文件再替换，其他进程不会读到不完整的文件）"""
+        with self._lock:
+            self._dirty = False
+            try:
+                write_json_atomic(self.mapping_file, self.account_proxy_map)
+            except Exception as e:
+                self._dirty = True
+                print(f"保存账号代理映射失败: {e}")
+    
+    _save_now = save_mapping
+    
+    def _assign(self, account: str, proxy_info: Dict):
+        """更新账号的代理映射（调用方持有锁并负责保存）"""
+        old = self.account_proxy_map.get(account)
+        if old:
+            sharers = self._sharers.get(proxy_key(old))
+            if sharers:
+                sharers.discard(account)
+                if not sharers:
+                    del self._sharers[proxy_key(old)]
+        # 每个账号保存一份副本，失败次数等按账号记录
+        entry = {k: v for k, v in proxy_info.items() if k != 'cohort'}
+        if self.accounts_per_proxy > 1:
+            entry['cohort'] = self._cohort_of(account)
+        self.account_proxy_map[account] = entry
+        self._sharers.setdefault(proxy_key(proxy_info), set()).add(account)
+    
+    def _cohort_of(self, account: str) -> int:
+        """账号的共用分组编号（调用方持有锁）
+        
+        没有分组的账号优先加入当前共用同一个代理的账号所在的分组（兼容旧映射文件），
+        否则加入编号最小的未满分组
+        """
+        cohort = self._cohorts.get(account)
+        if cohort is not None:
+            return cohort
+        old = self.account_proxy_map.get(account)
+        candidates = [self._cohorts[a] for a in self._sharers.get(proxy_key(old), ()) if a in self._cohorts] if old else []
+        cohort = next((c for c in candidates if len(self._members[c]) < self.accounts_per_proxy), None)
+        if cohort is None:
+            cohort = 0
+            while len(self._members.get(cohort, ())) >= self.accounts_per_proxy:
+                cohort += 1
+        self._cohorts[account] = cohort
+        self._members.setdefault(cohort, set()).add(account)
+        return cohort
+    
+    def _find_shared_proxy(self, account: str, exclude: Optional[Tuple[str, str]] = None) -> Optional[Dict]:
+        """查找同一分组中还有空位（共用账号数未达上限）、有效且未熔断的已分配代理"""
+        if self.accounts_per_proxy <= 1:
+            return None
+        with self._lock:
+            for member in self._members.get(self._cohort_of(account), ()):
+                proxy_info = self.account_proxy_map.get(member)
+                if member == account or not proxy_info:
+                    continue
+                key = proxy_key(proxy_info)
+                if key == exclude or len(self._sharers.get(key, ())) >= self.accounts_per_proxy:
+                    continue
+                if self.is_proxy_valid(proxy_info) and proxy_breakers.available(key):
+                    return {k: v for k, v in proxy_info.items() if k not in ('fail_count', 'last_used', 'cohort')}
+        return None
+    
+    @contextmanager
+    def proxy_slot(self, account: str):
+        """占用账号代理的一个并发名额，同一个代理上同时进行的请求不超过 max_concurrent_per_proxy"""
+        proxy_info = self._borrowed.get(account) or self.account_proxy_map.get(account)
+        if not proxy_info:
+            yield
+            return
+        key = proxy_key(proxy_info)
+        with self._lock:
+            semaphore = self._semaphores.get(key)
+            if semaphore is None:
+                semaphore = self._semaphores[key] = threading.BoundedSemaphore(self.max_concurrent_per_proxy)
+        with semaphore:
+            yield
     
     def get_proxy_for_account(self, account: str) -> Optional[Dict]:
-        """为指定账号获取代理"""
+        """为指定账号获取代理
+        
+        账号的代理熔断中（或半开状态的探测请求尚未返回）时保留映射，本次请求临时借用其他可用代理
+        （共用代理或新获取的代理，不写入映射），冷却后由半开状态的探测决定恢复使用还是继续熔断；
+        借不到任何代理时才返回 None 直接连接
+        """
         # 如果账号已有代理，返回现有代理
-        if account in self.account_proxy_map:
-            proxy_info = self.account_proxy_map[account]
-            # 检查代理是否仍然有效
-            if self.is_proxy_valid(proxy_info):
+        proxy_info = self.account_proxy_map.get(account)
+        if proxy_info and self.is_proxy_valid(proxy_info):
+            key = proxy_key(proxy_info)
+            # 半开状态的代理只放行一个探测请求
+            if proxy_breakers.allow_request(key):
+                self._borrowed.pop(account, None)
                 return proxy_info
+            return self._borrow_proxy(account, key)
         
         # 为账号分配新代理
         return self.assign_new_proxy_to_account(account)
     
+    def _borrow_proxy(self, account: str, exclude: Tuple[str, str]) -> Optional[Dict]:
+        """映射代理熔断期间为账号临时借用一个代理，熔断恢复前重复使用同一个借用代理"""
+        borrowed = self._borrowed.get(account)
+        if borrowed and self.is_proxy_valid(borrowed) and proxy_breakers.allow_request(proxy_key(borrowed)):
+            return borrowed
+        proxy_info = self._find_shared_proxy(account, exclude=exclude) or self.proxy_api.get_and_test_proxy()
+        if not proxy_info:
+            self._borrowed.pop(account, None)
+            print(f"账号 {account} 的代理熔断中且无可用代理，本次请求直接连接")
+            return None
+        self._borrowed[account] = proxy_info
+        print(f"账号 {account} 的代理熔断中，临时使用代理 {proxy_info['ip']}:{proxy_info['port']}")
+        return proxy_info
+    
     def assign_new_proxy_to_account(self, account: str) -> Optional[Dict]:
         """为账号分配新代理"""
         try:
             print(f"为账号 {account} 分配新代理...")
             
-            # 从API获取新代理
-            proxy_info = self.proxy_api.get_and_test_proxy()
+            # 优先共用还有空位的代理，否则从API获取新代理
+            proxy_info = self._find_shared_proxy(account) or self.proxy_api.get_and_test_proxy()
             if not proxy_info:
                 print(f"无法为账号 {account} 获取代理")
                 return None
             
             # 保存到映射
-            self.account_proxy_map[account] = proxy_info
-            self.save_mapping()
+            with self._lock:
+                self._assign(account, proxy_info)
+                self.save_mapping()
             
             print(f"账号 {account} 分配代理: {proxy_info['ip']}:{proxy_info['port']}")
             return proxy_info
@@ -64,15 +213,73 @@ class AccountProxyManager:
             print(f"为账号 {account} 分配代理失败: {e}")
             return None
     
+    def prepare_accounts(self, accounts: List[str], batch_size: int = PROXY_ASSIGN_BATCH) -> int:
+        """运行前为没有有效代理的账号批量分配代理，返回分配数量
+        
+        先填满同一分组中已有代理的共用空位，再使用预取池中已验证的代理，
+        不足时按 batch_size 批量向API获取并并发验证，所有分配完成后只写一次映射文件
+        """
+        with self._lock:
+            missing = [a for a in accounts if not self.is_proxy_valid(self.account_proxy_map.get(a))]
+            if not missing:
+                return 0
+            print(f"为 {len(missing)} 个账号批量分配代理...")
+            
+            shared = 0
+            groups: Dict[object, List[str]] = {}
+            for account in missing:
+                proxy_info = self._find_shared_proxy(account)
+                if proxy_info:
+                    self._assign(account, proxy_info)
+                    shared += 1
+                else:
+                    cohort = self._cohort_of(account) if self.accounts_per_proxy > 1 else account
+                    groups.setdefault(cohort, []).append(account)
+            # 每个新代理只分给同一分组的账号，每组最多 accounts_per_proxy 个
+            chunks = [group[i:i + self.accounts_per_proxy]
+                      for group in groups.values() for i in range(0, len(group), self.accounts_per_proxy)]
+            missing = [account for chunk in chunks for account in chunk]
+        
+        needed = len(chunks)
+        proxies = []
+        while len(proxies) < needed:
+            proxy_info = self.proxy_api.prefetch_pool.pop()
+            if not proxy_info:
+                break
+            proxies.append(proxy_info)
+        
+        # 每批都可能有部分代理验证失败，最多请求两倍于所需的批次
+        max_rounds = 2 * math.ceil((needed - len(proxies)) / batch_size)
+        for _ in range(max_rounds):
+            need = needed - len(proxies)
+            if need <= 0:
+                break
+            proxies.extend(self.proxy_api.test_proxies(self.proxy_api.get_proxies_from_api(min(need, batch_size))))
+        
+        with self._lock:
+            assigned = shared
+            for chunk, proxy_info in zip(chunks, proxies):
+                for account in chunk:
+                    self._assign(account, proxy_info)
+                assigned += len(chunk)
+            self.save_mapping()
+        
+        print(f"批量分配代理完成: {assigned}/{shared + len(missing)}")
+        return assigned
+    
+    def lease_window(self) -> float:
+        """新分配的代理可以放心使用的时长（秒）：租约时长减去提前更换的余量"""
+        return max(self.proxy_api.lease_seconds - PROXY_LEASE_MARGIN, 0)
+    
     def is_proxy_valid(self, proxy_info: Dict) -> bool:
         """检查代理是否有效"""
         try:
-            # 简单的有效性检查：代理信息完整且失败次数不多
+            # 简单的有效性检查：代理信息完整（熔断中的代理仍然有效，由 get_proxy_for_account 决定本次是否使用）
             if not proxy_info or 'ip' not in proxy_info or 'port' not in proxy_info:
                 return False
             
-            # 如果失败次数过多，认为无效
-            if proxy_info.get('fail_count', 0) >= 3:
+            # 租约已到期或即将到期，提前换新代理，避免请求超时后才发现
+            if is_lease_expired(proxy_info, PROXY_LEASE_MARGIN):
                 return False
             
             return True
@@ -80,34 +287,55 @@ class AccountProxyManager:
             return False
     
     def mark_proxy_failed(self, account: str):
-        """标记账号代理失败"""
-        if account in self.account_proxy_map:
-            proxy_info = self.account_proxy_map[account]
-            proxy_info['fail_count'] = proxy_info.get('fail_count', 0) + 1
-            self.save_mapping()
-            print(f"账号 {account} 代理失败，失败次数: {proxy_info['fail_count']}")
+        """标记账号代理失败（借用代理期间记在借用的代理上）"""
+        with self._lock:
+            borrowed = self._borrowed.pop(account, None)
+            if borrowed:
+                proxy_breakers.record(proxy_key(borrowed), False)
+                print(f"账号 {account} 临时代理失败")
+                return
+            if account in self.account_proxy_map:
+                proxy_info = self.account_proxy_map[account]
+                proxy_info['fail_count'] = proxy_info.get('fail_count', 0) + 1
+                proxy_breakers.record(proxy_key(proxy_info), False)
+                self.mark_dirty()
+                print(f"账号 {account} 代理失败，失败次数: {proxy_info['fail_count']}")
     
     def mark_proxy_success(self, account: str):
-        """标记账号代理成功"""
-        if account in self.account_proxy_map:
-            proxy_info = self.account_proxy_map[account]
-            proxy_info['fail_count'] = 0
-            proxy_info['last_used'] = time.strftime('%Y-%m-%d %H:%M:%S')
-            self.save_mapping()
+        """标记账号代理成功（借用代理期间记在借用的代理上）"""
+        with self._lock:
+            borrowed = self._borrowed.get(account)
+            if borrowed:
+                proxy_breakers.record(proxy_key(borrowed), True)
+                return
+            if account in self.account_proxy_map:
+                proxy_info = self.account_proxy_map[account]
+                proxy_info['fail_count'] = 0
+                proxy_info['last_used'] = time.strftime('%Y-%m-%d %H:%M:%S')
+                proxy_breakers.record(proxy_key(proxy_info), True)
+                self.mark_dirty()
     
     def refresh_account_proxy(self, account: str) -> Optional[Dict]:
         """刷新账号代理"""
         try:
             print(f"刷新账号 {account} 的代理...")
             
-            # 获取新代理
-            proxy_info = self.proxy_api.get_and_test_proxy()
+            # 失败的是临时借用的代理时，映射代理仍在熔断冷却中，只更换借用代理
+            if account in self._borrowed:
+                old = self._borrowed.pop(account)
+                return self._borrow_proxy(account, proxy_key(old))
+            
+            # 获取新代理（可共用其他账号的代理，但不能是当前失败的代理）
+            old = self.account_proxy_map.get(account)
+            proxy_info = (self._find_shared_proxy(account, exclude=proxy_key(old) if old else None)
+                          or self.proxy_api.get_and_test_proxy())
             if not proxy_info:
                 return None
             
             # 更新映射
-            self.account_proxy_map[account] = proxy_info
-            self.save_mapping()
+            with self._lock:
+                self._assign(account, proxy_info)
+                self.save_mapping()
             
             print(f"账号 {account} 代理已刷新: {proxy_info['ip']}:{proxy_info['port']}")
             return proxy_info
@@ -116,16 +344,36 @@ class AccountProxyManager:
             print(f"刷新账号 {account} 代理失败: {e}")
             return None
     
+    def renew_expiring(self, accounts: List[str], margin: float = PROXY_LEASE_MARGIN) -> int:
+        """为即将运行的账号续期：租约剩余不足 margin 秒的代理提前更换，返回更换数量"""
+        renewed = 0
+        for account in accounts:
+            proxy_info = self.account_proxy_map.get(account)
+            if proxy_info and lease_remaining(proxy_info) <= margin:
+                if self.refresh_account_proxy(account):
+                    renewed += 1
+        return renewed
+    
     def get_all_account_proxies(self) -> Dict:
         """获取所有账号的代理信息"""
-        return self.account_proxy_map.copy()
+        with self._lock:
+            return {account: dict(info) for account, info in self.account_proxy_map.items()}
     
     def remove_account_proxy(self, account: str):
         """移除账号代理"""
-        if account in self.account_proxy_map:
-            del self.account_proxy_map[account]
-            self.save_mapping()
-            print(f"已移除账号 {account} 的代理")
+        with self._lock:
+            if account in self.account_proxy_map:
+                proxy_info = self.account_proxy_map.pop(account)
+                sharers = self._sharers.get(proxy_key(proxy_info))
+                if sharers:
+                    sharers.discard(account)
+                    if not sharers:
+                        del self._sharers[proxy_key(proxy_info)]
+                cohort = self._cohorts.pop(account, None)
+                if cohort is not None:
+                    self._members[cohort].discard(account)
+                self.save_mapping()
+                print(f"已移除账号 {account} 的代理")
     
     def get_proxy_config_for_account(self, account: str) -> Optional[Dict]:
         """获取账号的代理配置"""
@@ -142,7 +390,7 @@ class AccountProxyManager:
     def list_all_mappings(self):
         """列出所有账号代理映射"""
         print("账号代理映射:")
-        for account, proxy_info in self.account_proxy_map.items():
+        for account, proxy_info in self.get_all_account_proxies().items():
             status = "✅" if self.is_proxy_valid(proxy_info) else "❌"
             print(f"{account}: {status} {proxy_info['ip']}:{proxy_info['port']} "
                   f"(失败: {proxy_info.get('fail_count', 0)})")
@@ -1,17 +1,41 @@
-from flask import Flask, request, render_template, jsonify, session, redirect, url_for
+from flask import Flask, request, render_template, jsonify, session, redirect, url_for, make_response
 from apscheduler.schedulers.background import BackgroundScheduler
 import requests
 import json
 import os
 import time
 import random
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from fake_useragent import UserAgent
+from session_pool import session_pool
+from rate_limiter import rate_limiter
+from retry_policy import retry_policy
+from token_cache import token_cache, is_auth_failure
+from status_store import StatusStore, TaskStateStore
+from log_writer import BufferedLogWriter, tail_lines, read_since
+from scheduler_leader import SchedulerLeader
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'  # 用于session
 ACCOUNTS_FILE = "accounts.json"
-STATUS_FILE = "status.json"
+STATUS_FILE = "status.json"  # 旧版状态文件，仅用于首次导入
+STATUS_DB_FILE = os.getenv("STATUS_DB_FILE", "status.db")
+# 多个 worker 进程通过该锁文件选出唯一运行定时任务的进程
+SCHEDULER_LOCK_FILE = os.getenv("SCHEDULER_LOCK_FILE", "scheduler.lock")
 LOG_FILE = "sign_log.txt"
+# 定时任务并发处理的账号数量
+AUTO_TASK_CONCURRENCY = max(1, int(os.getenv("AUTO_TASK_CONCURRENCY", "5")))
+# 定时任务执行模式：thread（线程池）或 async（asyncio 事件循环，需要 aiohttp）
+AUTO_TASK_MODE = os.getenv("AUTO_TASK_MODE", "thread")
+ASYNC_TASK_CONCURRENCY = max(1, int(os.getenv("ASYNC_TASK_CONCURRENCY", "100")))
+# 定时任务在计划时间后多久（秒）内仍可补跑（主进程被回收导致错过或中途退出时）
+DAILY_TASK_GRACE = int(os.getenv("DAILY_TASK_GRACE", "10800"))
+# 登录页等待后台自动登录时的刷新间隔（秒），自动登录成功的结果超过有效期（秒）后不再用于建立会话
+AUTO_LOGIN_POLL_INTERVAL = max(1, int(os.getenv("AUTO_LOGIN_POLL_INTERVAL", "3")))
+AUTO_LOGIN_RESULT_TTL = float(os.getenv("AUTO_LOGIN_RESULT_TTL", "600"))
 
 # 初始化随机UA生成器
 try:
@@ -47,15 +71,12 @@ def get_random_ua():
         print(f"生成随机UA失败: {e}")
         return "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
 
-def random_delay():
-    """随机延迟，避免请求过于频繁"""
-    time.sleep(random.uniform(0.5, 2.0))
-
 # 导入代理管理器
 try:
     from proxy_config import proxy_manager, get_proxy_config, make_request_with_proxy
-    from proxy_api import ProxyAPI
+    from proxy_api import proxy_api
     from account_proxy_manager import account_proxy_manager, get_proxy_config_for_account, mark_account_proxy_failed, mark_account_proxy_success, refresh_account_proxy
+    from async_client import AIOHTTP_AVAILABLE, run_accounts
     from auto_login_manager import auto_login_manager, add_auto_login_account, remove_auto_login_account, get_auto_login_accounts, get_enabled_auto_login_accounts, should_auto_login, get_login_credentials, get_all_login_credentials, update_account_login_date, update_last_login_date, get_auto_login_status, auto_login_account, auto_login_all_accounts
 except ImportError:
     # 如果代理模块不存在，使用简单的代理配置
@@ -90,85 +111,87 @@ except ImportError:
         else:
             log(f"直接发送请求: {method} {url}")
         
+        rate_limiter.wait(url, proxy_config['http'] if proxy_config else None)
         try:
-            if method.upper() == 'GET':
-                response = requests.get(url, **kwargs)
-            elif method.upper() == 'POST':
-                response = requests.post(url, **kwargs)
-            else:
+            if method.upper() not in ('GET', 'POST'):
                 raise ValueError(f"不支持的请求方法: {method}")
             
-            return response
+            return session_pool.request(method.upper(), url, **kwargs)
         except requests.exceptions.ProxyError as e:
             log(f"代理连接失败: {e}")
             # 如果代理失败，尝试直接连接
             if proxy_config:
                 log("尝试直接连接...")
                 kwargs.pop('proxies', None)
-                if method.upper() == 'GET':
-                    return requests.get(url, **kwargs)
-                elif method.upper() == 'POST':
-                    return requests.post(url, **kwargs)
+                return session_pool.request(method.upper(), url, **kwargs)
             raise
         except Exception as e:
             log(f"请求失败: {e}")
             raise
 
+    proxy_api = None
+
 def make_request_with_account_proxy(method, url, account, **kwargs):
-    """使用账号专用代理发送请求"""
-    try:
-        # 获取账号专用代理
-        proxy_config = get_proxy_config_for_account(account)
-        
-        if proxy_config:
-            kwargs['proxies'] = proxy_config
-            log(f"账号 {account} 使用代理发送请求: {method} {url} 代理: {proxy_config['http']}")
-        else:
-            log(f"账号 {account} 直接发送请求: {method} {url}")
-        
-        if method.upper() == 'GET':
-            response = requests.get(url, **kwargs)
-        elif method.upper() == 'POST':
-            response = requests.post(url, **kwargs)
-        else:
-            raise ValueError(f"不支持的请求方法: {method}")
-        
-        # 请求成功，标记代理成功
-        mark_account_proxy_success(account)
-        
-        return response
-        
-    except requests.exceptions.ProxyError as e:
-        log(f"账号 {account} 代理连接失败: {e}")
-        mark_account_proxy_failed(account)
-        
-        # 尝试刷新代理并重试
-        if refresh_account_proxy(account):
-            log(f"账号 {account} 代理已刷新，重试请求...")
-            return make_request_with_account_proxy(method, url, account, **kwargs)
-        else:
-            # 如果无法刷新代理，尝试直接连接
+    """使用账号专用代理发送请求
+    
+    代理连接失败时刷新代理重试，重试次数和改为直接连接的兜底请求都受全局重试策略（次数上限、重试预算）限制；
+    换用新代理重试不是重复请求同一条链路，不在线程中退避等待，请求间隔由限速器控制
+    """
+    if method.upper() not in ('GET', 'POST'):
+        raise ValueError(f"不支持的请求方法: {method}")
+    
+    retry_policy.record_request()
+    attempts = 0
+    while True:
+        try:
+            # 获取账号专用代理
+            proxy_config = get_proxy_config_for_account(account)
+            
+            if proxy_config:
+                kwargs['proxies'] = proxy_config
+                log(f"账号 {account} 使用代理发送请求: {method} {url} 代理: {proxy_config['http']}")
+            else:
+                kwargs.pop('proxies', None)
+                log(f"账号 {account} 直接发送请求: {method} {url}")
+            
+            # 同一个代理上同时进行的请求数有上限（多个账号共用代理时）
+            with account_proxy_manager.proxy_slot(account):
+                # 按目标主机和代理限速
+                rate_limiter.wait(url, proxy_config['http'] if proxy_config else None)
+                
+                # 复用该账号+代理的保持连接
+                response = session_pool.request(method.upper(), url, account=account, **kwargs)
+            
+            # 请求成功，标记代理成功（本次未使用代理时不影响代理的熔断状态）
+            if proxy_config:
+                mark_account_proxy_success(account)
+            
+            return response
+            
+        except requests.exceptions.ProxyError as e:
+            log(f"账号 {account} 代理连接失败: {e}")
+            mark_account_proxy_failed(account)
+            attempts += 1
+            
+            # 尝试刷新代理并重试
+            if retry_policy.allow_retry(attempts) and refresh_account_proxy(account):
+                log(f"账号 {account} 代理已刷新，重试请求...")
+                continue
+            
+            # 如果无法刷新代理或不再重试，尝试直接连接（同样计入重试预算）
+            if not retry_policy.allow_fallback():
+                raise
             log(f"账号 {account} 无法获取代理，尝试直接连接...")
             kwargs.pop('proxies', None)
-            if method.upper() == 'GET':
-                return requests.get(url, **kwargs)
-            elif method.upper() == 'POST':
-                return requests.post(url, **kwargs)
-                
-    except Exception as e:
-        log(f"账号 {account} 请求失败: {e}")
-        raise
-
-# 全局代理API实例
-proxy_api = None
-try:
-    proxy_api = ProxyAPI()
-except Exception as e:
-    log(f"初始化代理API失败: {e}")
+            rate_limiter.wait(url)
+            return session_pool.request(method.upper(), url, account=account, **kwargs)
+                    
+        except Exception as e:
+            log(f"账号 {account} 请求失败: {e}")
+            raise
 
 def update_proxy_from_api(max_retries=5):
-    """从API更新代理，支持多次重试"""
-    global proxy_api
+    """从API更新代理，支持多次重试（代理加入全局共享的代理池）"""
     if not proxy_api:
         return False
     
@@ -207,19 +230,23 @@ def save_accounts(accounts):
     with open(ACCOUNTS_FILE, "w", encoding="utf-8") as f:
         json.dump(accounts, f, ensure_ascii=False, indent=2)
 
-def load_status():
-    if os.path.exists(STATUS_FILE):
-        with open(STATUS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
+# 账号状态存储（SQLite），首次启动时导入旧版 status.json
+status_store = StatusStore(STATUS_DB_FILE, json_file=STATUS_FILE)
+# 定时任务运行状态，所有 worker 进程共享
+task_store = TaskStateStore(STATUS_DB_FILE)
+DAILY_TASK = "daily_sign_withdraw"
+AUTO_LOGIN_TASK = "auto_login"
 
-def save_status(status):
-    with open(STATUS_FILE, "w", encoding="utf-8") as f:
-        json.dump(status, f, ensure_ascii=False, indent=2)
+# 日志由后台线程批量写入并按大小/日期轮转
+log_writer = BufferedLogWriter(
+    LOG_FILE,
+    max_bytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+    backup_count=int(os.getenv("LOG_BACKUP_COUNT", "5")),
+    rotate_when=os.getenv("LOG_ROTATE", "size")
+)
 
 def log(msg):
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {msg}\n")
+    log_writer.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {msg}\n")
 
 def login_api(account, password):
     login_url = "https://qy.doufp.com/api/auth/login"
@@ -231,13 +258,38 @@ def login_api(account, password):
     
     # 使用账号专用代理
     try:
-        random_delay()
         resp = make_request_with_account_proxy('POST', login_url, account, headers=headers, json=data, timeout=15)
         return resp.json()
     except Exception as e:
         log(f"账号 {account} 登录API请求失败: {e}")
         return {"code": -1, "msg": f"网络请求失败: {e}"}
 
+def login_with_cache(account, password, refresh=False):
+    """获取账号token，缓存有效且密码一致时不再请求登录接口
+    
+    返回值与 login_api 相同的结构，refresh=True 时强制重新登录
+    """
+    if not refresh:
+        token = token_cache.get(account, password)
+        if token:
+            return {"code": 0, "msg": "使用缓存token", "data": {"token": token}}
+    
+    login_json = login_api(account, password)
+    token = login_json.get("data", {}).get("token")
+    if token:
+        token_cache.set(account, token, password)
+    return login_json
+
+def check_auth_failure(account, resp, data):
+    """接口返回认证失败时清除该账号的缓存token，并在结果中标记 auth_failed"""
+    if is_auth_failure(data, resp.status_code):
+        if account:
+            token_cache.invalidate(account)
+        if isinstance(data, dict):
+            data['auth_failed'] = True
+        return True
+    return False
+
 def sign_api(token, account=None):
     sign_url = "https://qy.doufp.com/api/user/sign"
     headers = {
@@ -248,12 +300,13 @@ def sign_api(token, account=None):
     
     # 使用账号专用代理
     try:
-        random_delay()
         if account:
             resp = make_request_with_account_proxy('POST', sign_url, account, headers=headers, json={}, timeout=15)
         else:
             resp = make_request_with_proxy('POST', sign_url, headers=headers, json={}, timeout=15)
-        return resp.json()
+        data = resp.json()
+        check_auth_failure(account, resp, data)
+        return data
     except Exception as e:
         log(f"账号 {account} 签到API请求失败: {e}")
         return {"code": -1, "msg": f"网络请求失败: {e}"}
@@ -268,13 +321,14 @@ def balance_api(token, account=None):
     
     # 使用账号专用代理
     try:
-        random_delay()
         if account:
             resp = make_request_with_account_proxy('GET', url, account, headers=headers, timeout=15)
         else:
             resp = make_request_with_proxy('GET', url, headers=headers, timeout=15)
         data = resp.json()
         print('balance_api返回:', data)
+        if check_auth_failure(account, resp, data):
+            return {'balance': 0, 'raw': data, 'auth_failed': True}
         # 查找 name_en 为 income_wallet 的资产（coinList）
         coin_list = data.get('data', {}).get('coinList', [])
         balance = 0
@@ -305,22 +359,61 @@ def withdraw_api(token, num, coin_type="income_wallet", withdraw_password="", ac
     
     # 使用账号专用代理
     try:
-        random_delay()
         if account:
             resp = make_request_with_account_proxy('POST', url, account, headers=headers, json=payload, timeout=15)
         else:
             resp = make_request_with_proxy('POST', url, headers=headers, json=payload, timeout=15)
-        return resp.json()
+        data = resp.json()
+        check_auth_failure(account, resp, data)
+        return data
     except Exception as e:
         log(f"账号 {account} 提现API请求失败: {e}")
         return {"code": -1, "msg": f"网络请求失败: {e}"}
 
+def sign_and_withdraw(account, token, password=None):
+    """登录后依次签到、查余额、提现，返回账号的状态记录
+    
+    传入密码时，签到、查余额、提现任一步发现token已失效，重新登录一次后重试该步
+    """
+    today = time.strftime('%Y-%m-%d')
+    can_relogin = bool(password)
+    
+    def call_with_relogin(call):
+        nonlocal token, can_relogin
+        result = call(token)
+        if result.get('auth_failed') and can_relogin:
+            can_relogin = False
+            log(f"账号 {account} token已失效，重新登录")
+            new_token = login_with_cache(account, password, refresh=True).get("data", {}).get("token")
+            if new_token:
+                token = new_token
+                result = call(token)
+        return result
+    
+    # 签到
+    sign_result = call_with_relogin(lambda t: sign_api(t, account))
+    signed = sign_result.get('code') == 0
+    sign_msg = sign_result.get('msg', '')
+    # 查余额
+    balance_json = call_with_relogin(lambda t: balance_api(t, account))
+    balance = balance_json.get('balance', 0)
+    # 提现（认证失败时上游未执行提现，重新登录后重试是安全的）
+    withdraw_result = call_with_relogin(lambda t: withdraw_api(t, str(balance), account=account)) if balance else {"msg": "无余额"}
+    withdraw_status = withdraw_result.get('msg', '')
+    return {
+        'date': today,
+        'signed': signed,
+        'sign_msg': sign_msg,
+        'balance': balance,
+        'withdraw_status': withdraw_status
+    }
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         account = request.form['account']
         password = request.form['password']
-        login_json = login_api(account, password)
+        login_json = login_with_cache(account, password)
         token = login_json.get("data", {}).get("token")
         if token:
             session['account'] = account
@@ -336,64 +429,115 @@ def login():
                 log(f"更新登录日期失败: {e}")
             
             # 登录成功后立即签到、查余额、提现
-            today = time.strftime('%Y-%m-%d')
-            status = load_status()
-            # 签到
-            sign_result = sign_api(token, account)
-            signed = sign_result.get('code') == 0
-            sign_msg = sign_result.get('msg', '')
-            # 查余额
-            balance_json = balance_api(token, account)
-            balance = balance_json.get('balance', 0)
-            # 提现
-            withdraw_result = withdraw_api(token, str(balance), account=account) if balance else {"msg": "无余额"}
-            withdraw_status = withdraw_result.get('msg', '')
-            # 存储状态
-            status[account] = {
-                'date': today,
-                'signed': signed,
-                'sign_msg': sign_msg,
-                'balance': balance,
-                'withdraw_status': withdraw_status
-            }
-            save_status(status)
+            status_store.upsert(account, sign_and_withdraw(account, token, password))
             return redirect(url_for('dashboard'))
         else:
             return render_template('login.html', error='登录失败，请检查账号密码')
     
-    # GET请求：检查是否需要自动登录
-    if should_auto_login():
-        all_credentials = get_all_login_credentials()
-        if all_credentials:
-            # 尝试所有需要登录的账号
-            for credentials in all_credentials:
-                log(f"尝试自动登录: {credentials['account']}")
-                
-                # 使用新的代理重试机制进行自动登录
-                success = auto_login_account(credentials['account'], credentials['password'])
-                
-                if success:
-                    # 登录成功，获取token用于session
-                    login_json = login_api(credentials['account'], credentials['password'])
-                    token = login_json.get("data", {}).get("token")
-                    if token:
-                        session['account'] = credentials['account']
-                        session['password'] = credentials['password']
-                        session['token'] = token
-                        
-                        log(f"自动登录成功: {credentials['account']}")
-                        return redirect(url_for('dashboard'))
-                else:
-                    log(f"自动登录失败: {credentials['account']}")
+    # GET请求：本会话发起的自动登录已成功时直接进入控制台
+    if attach_auto_login_session():
+        return redirect(url_for('dashboard'))
+    
+    # 需要自动登录时在后台启动任务并记入本会话，页面立即返回；本会话今天的任务失败后不再自动发起
+    auto_login_job = auto_login_job_state()
+    if not auto_login_job and session.get('auto_login_tried') != time.strftime('%Y-%m-%d') and should_auto_login():
+        auto_login_job = start_auto_login_job()
+    
+    response = make_response(render_template('login.html', auto_login_job=auto_login_job))
+    if auto_login_job and auto_login_job['is_running']:
+        # 任务进行中时浏览器定时刷新登录页（也可以轮询 /api/auto_login_job），任务成功后由上面的判断跳转
+        response.headers['Refresh'] = str(AUTO_LOGIN_POLL_INTERVAL)
+    return response
+
+def run_auto_login_job(all_credentials, run_id):
+    """后台依次尝试自动登录，直到有一个账号登录成功"""
+    try:
+        for credentials in all_credentials:
+            account = credentials['account']
+            task_store.increment(AUTO_LOGIN_TASK, run_id, total_accounts=1)
+            log(f"尝试自动登录: {account}")
+            
+            # 使用新的代理重试机制进行自动登录，登录接口返回保存到共享的任务存储，建立会话时直接使用
+            success, result = auto_login_account(account, credentials['password'])
+            if success:
+                log(f"自动登录成功: {account}")
+                task_store.save_result(run_id, account, result)
+                task_store.record_outcome(run_id, account, True, "自动登录成功")
+                task_store.increment(AUTO_LOGIN_TASK, run_id, success_count=1)
+                break
+            
+            message = f"自动登录失败: {result.get('msg', '未知错误')}"
+            log(f"{account} {message}")
+            task_store.record_outcome(run_id, account, False, message)
+            task_store.increment(AUTO_LOGIN_TASK, run_id, error_count=1)
+    except Exception as e:
+        log(f"自动登录任务异常: {e}")
+    finally:
+        task_store.finish(AUTO_LOGIN_TASK, run_id)
+
+def start_auto_login_job():
+    """有需要登录的账号时在后台启动自动登录任务，并把运行ID记入当前会话，返回任务状态
+    
+    运行标记由 task_store 原子占用，多个页面（或多个进程）同时访问时只会启动一个任务，
+    其他页面加入正在运行的任务
+    """
+    all_credentials = get_all_login_credentials()
+    if not all_credentials:
+        return None
+    run_id = task_store.try_start(AUTO_LOGIN_TASK)
+    if run_id:
+        thread = threading.Thread(target=run_auto_login_job, args=(all_credentials, run_id))
+        thread.daemon = True
+        thread.start()
+    state = task_store.get(AUTO_LOGIN_TASK)
+    if state['run_id'] and state['is_running']:
+        session['auto_login_run'] = state['run_id']
+    return state
+
+def auto_login_job_state():
+    """当前会话发起（或加入）的今天的自动登录任务状态，没有时返回 None 并清除会话中的运行ID"""
+    run_id = session.get('auto_login_run')
+    if not run_id:
+        return None
+    state = task_store.get(AUTO_LOGIN_TASK)
+    if state['run_id'] != run_id or not (state['last_run'] or '').startswith(time.strftime('%Y-%m-%d')):
+        session.pop('auto_login_run', None)
+        return None
+    return state
+
+def attach_auto_login_session():
+    """当前会话的自动登录任务有账号登录成功时建立会话，返回是否已登录
     
-    return render_template('login.html')
+    使用任务保存在共享任务存储中的登录接口返回（任意 worker 进程都能取到，取用后删除），
+    不在请求中调用登录接口；结果超过 AUTO_LOGIN_RESULT_TTL 后失效
+    """
+    state = auto_login_job_state()
+    if not state:
+        return False
+    record = task_store.pop_result(state['run_id'], AUTO_LOGIN_RESULT_TTL)
+    if record:
+        account, result = record
+        token = result.get("data", {}).get("token")
+        password = next((acc['password'] for acc in get_auto_login_accounts() if acc['account'] == account), None)
+        if token and password is not None:
+            token_cache.set(account, token, password)
+            session['account'] = account
+            session['password'] = password
+            session['token'] = token
+            session.pop('auto_login_run', None)
+            return True
+    if not state['is_running']:
+        # 任务已结束且没有可用结果，不再等待
+        session.pop('auto_login_run', None)
+        session['auto_login_tried'] = time.strftime('%Y-%m-%d')
+    return False
 
 @app.route('/dashboard')
 def dashboard():
     if 'account' not in session:
         return redirect(url_for('login'))
     account = session['account']
-    status = load_status().get(account, {})
+    status = status_store.get(account)
     today = time.strftime('%Y-%m-%d')
     signed = status.get('date') == today and status.get('signed', False)
     balance = status.get('balance', '--')
@@ -405,7 +549,7 @@ def api_sign_status():
     if 'account' not in session:
         return jsonify({'error': '未登录'}), 401
     account = session['account']
-    status = load_status().get(account, {})
+    status = status_store.get(account)
     today = time.strftime('%Y-%m-%d')
     signed = status.get('date') == today and status.get('signed', False)
     return jsonify({'signed': signed})
@@ -415,7 +559,7 @@ def api_balance():
     if 'account' not in session:
         return jsonify({'error': '未登录'}), 401
     account = session['account']
-    status = load_status().get(account, {})
+    status = status_store.get(account)
     balance = status.get('balance', '--')
     return jsonify({'balance': balance})
 
@@ -424,14 +568,14 @@ def api_withdraw_status():
     if 'account' not in session:
         return jsonify({'error': '未登录'}), 401
     account = session['account']
-    status = load_status().get(account, {})
+    status = status_store.get(account)
     withdraw_status = status.get('withdraw_status', '--')
     return jsonify({'withdraw_status': withdraw_status})
 
 @app.route('/api/accounts')
 def api_accounts():
     accounts = load_accounts()
-    status = load_status()
+    status = status_store.get_all()
     today = time.strftime('%Y-%m-%d')
     result = []
     for acc in accounts:
@@ -457,10 +601,7 @@ def api_delete_account():
     accounts = [a for a in accounts if a['account'] != account]
     save_accounts(accounts)
     # 同时删除状态
-    status = load_status()
-    if account in status:
-        del status[account]
-        save_status(status)
+    status_store.delete([account])
     return jsonify({'status': 'ok'})
 
 @app.route('/api/batch_delete', methods=['POST'])
@@ -471,49 +612,27 @@ def api_batch_delete():
     accounts = [a for a in accounts if a['account'] not in del_accounts]
     save_accounts(accounts)
     # 同时删除状态
-    status = load_status()
-    for acc in del_accounts:
-        if acc in status:
-            del status[acc]
-    save_status(status)
+    status_store.delete(del_accounts)
     return jsonify({'status': 'ok'})
 
 @app.route('/api/batch_sign_withdraw', methods=['POST'])
 def api_batch_sign_withdraw():
     data = request.json
     batch_accounts = data.get('accounts', [])
-    today = time.strftime('%Y-%m-%d')
-    status = load_status()
     results = []
     for acc in load_accounts():
         if acc['account'] in batch_accounts:
             account = acc['account']
             password = acc['password']
-            login_json = login_api(account, password)
+            login_json = login_with_cache(account, password)
             token = login_json.get("data", {}).get("token")
             if not token:
                 results.append({'account': account, 'result': '登录失败'})
                 continue
-            # 签到
-            sign_result = sign_api(token, account)
-            signed = sign_result.get('code') == 0
-            sign_msg = sign_result.get('msg', '')
-            # 查余额
-            balance_json = balance_api(token, account)
-            balance = balance_json.get('balance', 0)
-            # 提现
-            withdraw_result = withdraw_api(token, str(balance), account=account) if balance else {"msg": "无余额"}
-            withdraw_status = withdraw_result.get('msg', '')
+            entry = sign_and_withdraw(account, token, password)
             # 存储状态
-            status[account] = {
-                'date': today,
-                'signed': signed,
-                'sign_msg': sign_msg,
-                'balance': balance,
-                'withdraw_status': withdraw_status
-            }
-            save_status(status)
-            results.append({'account': account, 'result': f"签到:{'成功' if signed else '失败'}({sign_msg}) 余额:{balance} 提现:{withdraw_status}"})
+            status_store.upsert(account, entry)
+            results.append({'account': account, 'result': f"签到:{'成功' if entry['signed'] else '失败'}({entry['sign_msg']}) 余额:{entry['balance']} 提现:{entry['withdraw_status']}"})
     return jsonify({'results': results})
 
 @app.route("/add_account", methods=["POST"])
@@ -525,7 +644,7 @@ def add_account():
     # 添加账号前先验证账号是否可用（使用代理）
     try:
         log(f"验证新账号: {account}")
-        login_json = login_api(account, password)
+        login_json = login_with_cache(account, password)
         token = login_json.get("data", {}).get("token")
         if not token:
             return jsonify({"status": "error", "msg": "账号验证失败，请检查账号密码"})
@@ -542,133 +661,210 @@ def add_account():
         log(f"添加账号异常: {e}")
         return jsonify({"status": "error", "msg": f"添加账号失败: {e}"})
 
-def auto_sign_and_withdraw():
-    """定时任务：自动签到、查余额、提现"""
-    global TASK_STATUS
+def record_account_result(run_id, account, entry, error=None):
+    """保存单个账号的处理结果并更新共享的任务进度"""
+    if entry is None:
+        log(f"{account} {error}")
+        task_store.record_outcome(run_id, account, False, error)
+        task_store.increment(DAILY_TASK, run_id, error_count=1)
+        return
     
-    TASK_STATUS["is_running"] = True
-    TASK_STATUS["last_run"] = time.strftime('%Y-%m-%d %H:%M:%S')
-    TASK_STATUS["total_accounts"] = 0
-    TASK_STATUS["success_count"] = 0
-    TASK_STATUS["error_count"] = 0
+    # 存储状态
+    status_store.upsert(account, entry)
+    message = f"签到:{'成功' if entry['signed'] else '失败'}({entry['sign_msg']}) 余额:{entry['balance']} 提现:{entry['withdraw_status']}"
+    log(f"{account} 自动{message}")
+    task_store.record_outcome(run_id, account, entry['signed'], message)
+    if entry['signed']:
+        task_store.increment(DAILY_TASK, run_id, success_count=1)
+    else:
+        task_store.increment(DAILY_TASK, run_id, error_count=1)
+
+def run_account_task(acc, run_id):
+    """定时任务中处理单个账号，异常只影响当前账号"""
+    account = acc['account']
+    password = acc['password']
+    task_store.increment(DAILY_TASK, run_id, total_accounts=1)
     
     try:
+        # 账号即将开始请求，代理租约快到期时先换新代理
+        account_proxy_manager.renew_expiring([account])
+        login_json = login_with_cache(account, password)
+        token = login_json.get("data", {}).get("token")
+        if not token:
+            record_account_result(run_id, account, None, f"自动登录失败: {login_json}")
+            return
+        
+        record_account_result(run_id, account, sign_and_withdraw(account, token, password))
+            
+    except Exception as e:
+        record_account_result(run_id, account, None, f"处理异常: {e}")
+
+def run_in_proxy_waves(accounts, first_wave, run_wave):
+    """按代理租约分波处理账号
+    
+    代理租约很短，运行前一次性为所有账号分配代理时，后面的账号开始前租约早已过期，只能逐个续期。
+    因此每波开始前为本波的全部账号批量分配（或批量续期）代理（已签到的账号仍要查余额、提现）；
+    下一波的大小按本波的处理速度估算为一个租约窗口内能开始处理的账号数
+    """
+    window = account_proxy_manager.lease_window()
+    start, wave_size = 0, first_wave
+    while start < len(accounts):
+        wave = accounts[start:start + wave_size]
+        wave_started = time.time()
+        account_proxy_manager.prepare_accounts([acc['account'] for acc in wave])
+        run_wave(wave)
+        start += len(wave)
+        elapsed = time.time() - wave_started
+        wave_size = max(first_wave, int(len(wave) * window / elapsed)) if elapsed > 0 and window else len(accounts)
+
+def run_accounts_async(accounts, concurrency, run_id):
+    """使用 asyncio 客户端在单个事件循环中处理所有账号"""
+    def on_result(account, entry, error):
+        task_store.increment(DAILY_TASK, run_id, total_accounts=1)
+        record_account_result(run_id, account, entry, error)
+    
+    asyncio.run(run_accounts(accounts, on_result, concurrency=concurrency,
+                             proxy_manager=account_proxy_manager, user_agent=get_random_ua))
+
+def auto_sign_and_withdraw(concurrency=None, run_id=None):
+    """定时任务：自动签到、查余额、提现
+    
+    Args:
+        concurrency: 同时处理的账号数量，默认使用 AUTO_TASK_CONCURRENCY
+        run_id: 已通过 task_store.try_start 取得的运行ID，为 None 时自行获取
+    """
+    if run_id is None:
+        run_id = task_store.try_start(DAILY_TASK)
+        if not run_id:
+            log("定时任务正在运行中，本次跳过")
+            return
+    
+    # 只有调度器主进程在任务运行期间后台预取代理，任务结束后停止
+    prefetch_pool = account_proxy_manager.proxy_api.prefetch_pool if scheduler_leader.is_leader else None
+    # 更新代理、分配代理等阶段不会更新进度，由后台线程刷新心跳，避免被其他进程当作已退出而重复启动
+    heartbeat = task_store.keep_alive(DAILY_TASK, run_id)
+    try:
+        if prefetch_pool:
+            prefetch_pool.start()
+        
         # 任务开始前自动更新代理
         log("定时任务开始，尝试更新代理...")
         update_proxy_from_api()
         
         accounts = load_accounts()
-        today = time.strftime('%Y-%m-%d')
-        status = load_status()
-        
-        log(f"开始定时任务，共 {len(accounts)} 个账号")
         
-        for acc in accounts:
-            TASK_STATUS["total_accounts"] += 1
-            account = acc['account']
-            password = acc['password']
-            
-            try:
-                login_json = login_api(account, password)
-                token = login_json.get("data", {}).get("token")
-                if not token:
-                    log(f"{account} 自动登录失败: {login_json}")
-                    TASK_STATUS["error_count"] += 1
-                    continue
-                
-                # 签到
-                sign_result = sign_api(token, account)
-                signed = sign_result.get('code') == 0
-                sign_msg = sign_result.get('msg', '')
-                
-                # 查余额
-                balance_json = balance_api(token, account)
-                balance = balance_json.get('balance', 0)
-                
-                # 提现
-                withdraw_result = withdraw_api(token, str(balance), account=account) if balance else {"msg": "无余额"}
-                withdraw_status = withdraw_result.get('msg', '')
-                
-                # 存储状态
-                status[account] = {
-                    'date': today,
-                    'signed': signed,
-                    'sign_msg': sign_msg,
-                    'balance': balance,
-                    'withdraw_status': withdraw_status
-                }
-                save_status(status)
-                
-                log(f"{account} 自动签到:{'成功' if signed else '失败'}({sign_msg}) 余额:{balance} 提现:{withdraw_status}")
-                
-                if signed:
-                    TASK_STATUS["success_count"] += 1
-                else:
-                    TASK_STATUS["error_count"] += 1
-                    
-            except Exception as e:
-                log(f"{account} 处理异常: {e}")
-                TASK_STATUS["error_count"] += 1
+        # 按波批量分配代理，避免运行中逐个向代理API请求
+        if AUTO_TASK_MODE == "async" and AIOHTTP_AVAILABLE:
+            workers = concurrency or ASYNC_TASK_CONCURRENCY
+            log(f"开始定时任务（异步模式），共 {len(accounts)} 个账号，并发数 {workers}")
+            run_in_proxy_waves(accounts, workers, lambda wave: run_accounts_async(wave, workers, run_id))
+        else:
+            workers = max(1, min(concurrency or AUTO_TASK_CONCURRENCY, len(accounts) or 1))
+            log(f"开始定时任务，共 {len(accounts)} 个账号，并发数 {workers}")
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                run_in_proxy_waves(accounts, workers,
+                                   lambda wave: list(executor.map(lambda acc: run_account_task(acc, run_id), wave)))
         
-        log(f"定时任务完成，成功: {TASK_STATUS['success_count']}, 失败: {TASK_STATUS['error_count']}")
+        state = task_store.get(DAILY_TASK)
+        log(f"定时任务完成，成功: {state['success_count']}, 失败: {state['error_count']}")
         
     except Exception as e:
         log(f"定时任务异常: {e}")
     finally:
-        TASK_STATUS["is_running"] = False
+        if prefetch_pool:
+            prefetch_pool.stop()
+        heartbeat.set()
+        task_store.finish(DAILY_TASK, run_id)
+
+def catch_up_daily_task():
+    """补跑定时任务：今天的任务没有运行（主进程在计划时间被回收）或中途退出时，在宽限时间内重新运行"""
+    now = datetime.now()
+    scheduled = now.replace(hour=0, minute=30, second=0, microsecond=0)
+    if not scheduled <= now <= scheduled + timedelta(seconds=DAILY_TASK_GRACE):
+        return
+    state = task_store.get(DAILY_TASK)
+    if state['is_running']:
+        return
+    if (state['last_run'] or '').startswith(time.strftime('%Y-%m-%d')) and state['finished_at']:
+        return
+    log("今天的定时任务没有完成，开始补跑")
+    auto_sign_and_withdraw()
+
+def start_scheduler():
+    """当选主进程后启动调度器，并立即检查是否需要补跑（接管时可能已错过计划时间）"""
+    scheduler.start()
+    scheduler.add_job(catch_up_daily_task, id="daily_catch_up_on_elected")
 
 # 定时任务：每天00:30自动签到、查余额、提现
+# 只有选举出的主进程启动调度器，其他 worker 待命，主进程退出（如被 gunicorn --max-requests 回收）后自动接管
 scheduler = BackgroundScheduler()
-scheduler.add_job(auto_sign_and_withdraw, "cron", hour=0, minute=30, id="daily_sign_withdraw")
-scheduler.start()
-
-# 记录定时任务状态
-TASK_STATUS = {
-    "last_run": None,
-    "next_run": None,
-    "is_running": False,
-    "total_accounts": 0,
-    "success_count": 0,
-    "error_count": 0
-}
+scheduler.add_job(auto_sign_and_withdraw, "cron", hour=0, minute=30, id=DAILY_TASK,
+                  misfire_grace_time=DAILY_TASK_GRACE, coalesce=True)
+# 主进程中途被回收时，接管的进程定期检查并补跑（运行标记由 task_store 原子占用，不会重复运行）
+scheduler.add_job(catch_up_daily_task, "interval", minutes=5, id="daily_catch_up",
+                  coalesce=True, max_instances=1)
+scheduler_leader = SchedulerLeader(SCHEDULER_LOCK_FILE, on_elected=start_scheduler,
+                                   retry_interval=float(os.getenv("SCHEDULER_LEADER_RETRY", "5")))
+scheduler_leader.start()
+
+def get_next_run_time():
+    """定时任务下次运行时间（非主进程的调度器未启动，按触发器计算）"""
+    job = scheduler.get_job(DAILY_TASK)
+    if not job:
+        return None
+    next_run = getattr(job, 'next_run_time', None)
+    if next_run is None and not scheduler.running:
+        next_run = job.trigger.get_next_fire_time(None, datetime.now(job.trigger.timezone))
+    return next_run.strftime('%Y-%m-%d %H:%M:%S') if next_run else None
 
 @app.route("/api/task_status")
 def api_task_status():
-    """获取定时任务状态"""
-    global TASK_STATUS
+    """获取定时任务状态（details=1 时附带本次运行每个账号的结果）"""
+    state = task_store.get(DAILY_TASK)
     # 获取下次运行时间
-    job = scheduler.get_job("daily_sign_withdraw")
-    if job:
-        TASK_STATUS["next_run"] = job.next_run_time.strftime('%Y-%m-%d %H:%M:%S') if job.next_run_time else None
+    state["next_run"] = get_next_run_time()
+    if request.args.get('details') and state.get('run_id'):
+        state["outcomes"] = task_store.get_outcomes(state['run_id'])
     
-    return jsonify(TASK_STATUS)
+    return jsonify(state)
 
 @app.route("/api/manual_task", methods=['POST'])
 def api_manual_task():
     """手动触发定时任务"""
-    global TASK_STATUS
-    if TASK_STATUS["is_running"]:
+    # 原子地占用运行标记，其他进程同时触发时只有一个能成功
+    run_id = task_store.try_start(DAILY_TASK)
+    if not run_id:
         return jsonify({"status": "error", "msg": "任务正在运行中"})
     
     try:
+        data = request.get_json(silent=True) or {}
+        concurrency = data.get('concurrency')
         # 异步执行任务
-        import threading
-        thread = threading.Thread(target=auto_sign_and_withdraw)
+        thread = threading.Thread(target=auto_sign_and_withdraw, args=(int(concurrency) if concurrency else None, run_id))
         thread.daemon = True
         thread.start()
-        return jsonify({"status": "ok", "msg": "任务已启动"})
+        return jsonify({"status": "ok", "msg": "任务已启动", "run_id": run_id})
     except Exception as e:
+        task_store.finish(DAILY_TASK, run_id)
         return jsonify({"status": "error", "msg": f"启动失败: {e}"})
 
 @app.route("/api/task_log")
 def api_task_log():
-    """获取最近的日志"""
+    """获取最近的日志
+    
+    参数:
+        lines: 返回的最大行数（默认50）
+        since: 上次返回的 offset，传入时只返回之后新增的日志
+        file_id: 上次返回的 file_id，用于识别日志是否已轮转
+    """
     try:
-        with open(LOG_FILE, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-            # 返回最近50行日志
-            recent_logs = lines[-50:] if len(lines) > 50 else lines
-            return jsonify({"logs": recent_logs})
+        max_lines = min(max(request.args.get('lines', 50, type=int), 1), 1000)
+        since = request.args.get('since', type=int)
+        if since is None:
+            logs, offset, file_id = tail_lines(LOG_FILE, max_lines)
+        else:
+            logs, offset, file_id = read_since(LOG_FILE, since, max_lines, file_id=request.args.get('file_id', type=int))
+        return jsonify({"logs": logs, "offset": offset, "file_id": file_id})
     except Exception as e:
         return jsonify({"logs": [], "error": str(e)})
 
@@ -694,8 +890,7 @@ def api_proxy_status():
         return jsonify({"status": "error", "msg": "未登录"}), 401
     
     try:
-        from proxy_config import proxy_manager
-        proxies = proxy_manager.proxy_list
+        proxies = proxy_manager.snapshot()
         available_count = len([p for p in proxies if p.get('enabled', True)])
         total_count = len(proxies)
         
@@ -802,6 +997,20 @@ def api_auto_login_control():
     except Exception as e:
         return jsonify({"status": "error", "msg": f"操作失败: {e}"})
 
+@app.route("/api/auto_login_job")
+def api_auto_login_job():
+    """登录页轮询本会话发起的自动登录任务的进度，有账号登录成功时建立会话并返回跳转地址"""
+    try:
+        state = auto_login_job_state()
+        if not state:
+            return jsonify({"status": "error", "msg": "没有进行中的自动登录任务"})
+        state["outcomes"] = task_store.get_outcomes(state['run_id'])
+        if attach_auto_login_session():
+            state["redirect"] = url_for('dashboard')
+        return jsonify(state)
+    except Exception as e:
+        return jsonify({"status": "error", "msg": f"获取自动登录任务状态失败: {e}"})
+
 @app.route("/api/add_auto_login_account", methods=['POST'])
 def api_add_auto_login_account():
     """添加自动登录账号"""
@@ -818,7 +1027,7 @@ def api_add_auto_login_account():
             return jsonify({"status": "error", "msg": "账号和密码不能为空"})
         
         # 验证账号密码是否有效
-        login_json = login_api(account, password)
+        login_json = login_with_cache(account, password)
         token = login_json.get("data", {}).get("token")
         if not token:
             return jsonify({"status": "error", "msg": "账号密码验证失败，请检查输入"})
@@ -932,7 +1141,8 @@ def health_check():
             "version": "1.0.0",
             "services": {
                 "flask": "running",
-                "scheduler": "running" if scheduler.running else "stopped"
+                "scheduler": "running" if scheduler.running else "standby",
+                "scheduler_leader_pid": scheduler_leader.holder_pid
             }
         }
         return jsonify(status), 200
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+异步上游接口客户端
+基于 asyncio + aiohttp 提供登录、签到、查余额、提现协程，
+单个事件循环即可并发处理大量账号，支持账号专用代理
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Iterable, Optional
+
+from rate_limiter import rate_limiter
+from retry_policy import retry_policy
+from token_cache import token_cache, is_auth_failure
+
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    aiohttp = None
+    AIOHTTP_AVAILABLE = False
+    print("警告: aiohttp库未安装，异步客户端不可用")
+
+BASE_URL = "https://qy.doufp.com"
+DEFAULT_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+class AsyncUpstreamClient:
+    """异步上游客户端，需在 async with 中使用以复用连接池"""
+
+    def __init__(self, proxy_manager=None, user_agent: Optional[Callable[[], str]] = None,
+                 timeout: int = 15, connection_limit: int = 100):
+        """
+        Args:
+            proxy_manager: AccountProxyManager 实例，为 None 时直接连接
+            user_agent: 返回 User-Agent 的函数
+            timeout: 单次请求超时（秒）
+            connection_limit: 连接池最大连接数
+        """
+        if not AIOHTTP_AVAILABLE:
+            raise RuntimeError("aiohttp库未安装，无法使用异步客户端")
+        self.proxy_manager = proxy_manager
+        self.user_agent = user_agent or (lambda: DEFAULT_USER_AGENT)
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.connection_limit = connection_limit
+        self._session = None
+        # 每个代理的并发请求上限（与 AccountProxyManager.proxy_slot 一致）
+        self._proxy_slots: Dict[str, asyncio.Semaphore] = {}
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.connection_limit)
+        self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._session.close()
+        self._session = None
+
+    async def _run_blocking(self, func, *args):
+        """代理管理器是同步实现（可能访问代理API），放到线程池执行以免阻塞事件循环"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, func, *args)
+
+    async def _get_proxy_url(self, account: Optional[str]) -> Optional[str]:
+        """获取账号专用代理地址"""
+        if not account or not self.proxy_manager:
+            return None
+        proxy_config = await self._run_blocking(self.proxy_manager.get_proxy_config_for_account, account)
+        return proxy_config.get('http') if proxy_config else None
+
+    @asynccontextmanager
+    async def _proxy_slot(self, proxy: Optional[str]):
+        """占用代理的一个并发名额"""
+        if not proxy or not self.proxy_manager:
+            yield
+            return
+        slot = self._proxy_slots.get(proxy)
+        if slot is None:
+            slot = self._proxy_slots[proxy] = asyncio.Semaphore(self.proxy_manager.max_concurrent_per_proxy)
+        async with slot:
+            yield
+
+    async def _request(self, method: str, path: str, account: Optional[str] = None,
+                       headers: Optional[Dict] = None, json: Optional[Dict] = None) -> Dict:
+        """发送请求并返回JSON，代理失败时刷新代理重试一次，仍失败则直接连接
+        
+        经代理请求时的超时和连接被断开也视为代理失败（坏代理常见的表现）
+        """
+        url = f"{BASE_URL}{path}"
+        proxy = await self._get_proxy_url(account)
+        retry_policy.record_request()
+
+        for attempt in range(2):
+            try:
+                async with self._proxy_slot(proxy):
+                    await rate_limiter.wait_async(url, proxy)
+                    async with self._session.request(method, url, headers=headers, json=json, proxy=proxy) as resp:
+                        data = await resp.json(content_type=None)
+                        status_code = resp.status
+                if account and isinstance(data, dict) and is_auth_failure(data, status_code):
+                    token_cache.invalidate(account)
+                    data['auth_failed'] = True
+                if proxy:
+                    await self._run_blocking(self.proxy_manager.mark_proxy_success, account)
+                return data
+            except (aiohttp.ClientProxyConnectionError, aiohttp.ClientHttpProxyError,
+                    aiohttp.ServerDisconnectedError, asyncio.TimeoutError) as e:
+                if not proxy:
+                    raise
+                print(f"账号 {account} 代理连接失败: {e}")
+                await self._run_blocking(self.proxy_manager.mark_proxy_failed, account)
+                proxy = None
+                if (attempt == 0 and retry_policy.allow_retry(attempt + 1)
+                        and await self._run_blocking(self.proxy_manager.refresh_account_proxy, account)):
+                    proxy = await self._get_proxy_url(account)
+                if not proxy:
+                    # 直接连接同样计入重试预算
+                    if not retry_policy.allow_fallback():
+                        raise
+                    print(f"账号 {account} 无法获取代理，尝试直接连接...")
+        await rate_limiter.wait_async(url)
+        async with self._session.request(method, url, headers=headers, json=json) as resp:
+            return await resp.json(content_type=None)
+
+    def _headers(self, token: Optional[str] = None) -> Dict:
+        headers = {
+            "content-type": "application/json;charset=UTF-8",
+            "user-agent": self.user_agent()
+        }
+        if token:
+            headers["authorization"] = token
+        return headers
+
+    async def login(self, account: str, password: str, refresh: bool = False) -> Dict:
+        """登录，返回接口原始JSON；token缓存有效时直接复用"""
+        if not refresh:
+            token = token_cache.get(account, password)
+            if token:
+                return {"code": 0, "msg": "使用缓存token", "data": {"token": token}}
+        data = {"account": account, "captcha": "", "key": None, "password": password}
+        try:
+            result = await self._request('POST', "/api/auth/login", account, self._headers(), data)
+        except Exception as e:
+            return {"code": -1, "msg": f"网络请求失败: {e}"}
+        token = result.get("data", {}).get("token") if isinstance(result.get("data"), dict) else None
+        if token:
+            token_cache.set(account, token, password)
+        return result
+
+    async def sign(self, token: str, account: Optional[str] = None) -> Dict:
+        """签到"""
+        try:
+            return await self._request('POST', "/api/user/sign", account, self._headers(token), {})
+        except Exception as e:
+            return {"code": -1, "msg": f"网络请求失败: {e}"}
+
+    async def balance(self, token: str, account: Optional[str] = None) -> Dict:
+        """查询 income_wallet 余额"""
+        try:
+            data = await self._request('GET', "/api/assets/myAssets", account, self._headers(token))
+            balance = 0
+            for asset in data.get('data', {}).get('coinList', []):
+                if asset.get('name_en') == 'income_wallet':
+                    try:
+                        balance = float(asset.get('num', 0))
+                    except Exception:
+                        balance = 0
+                    break
+            return {'balance': balance, 'raw': data, 'auth_failed': bool(data.get('auth_failed'))}
+        except Exception as e:
+            return {'balance': 0, 'raw': {}, 'error': str(e)}
+
+    async def withdraw(self, token: str, num, coin_type: str = "income_wallet",
+                       withdraw_password: str = "", account: Optional[str] = None) -> Dict:
+        """提现"""
+        payload = {"coin_type": coin_type, "num": num, "password": withdraw_password}
+        try:
+            return await self._request('POST', "/api/assets/withdraw", account, self._headers(token), payload)
+        except Exception as e:
+            return {"code": -1, "msg": f"网络请求失败: {e}"}
+
+    async def sign_and_withdraw(self, account: str, token: str, password: Optional[str] = None) -> Dict:
+        """签到、查余额、提现，返回账号的状态记录（与 app.sign_and_withdraw 一致）
+
+        传入密码时，任一步发现token已失效，重新登录一次后重试该步
+        """
+        can_relogin = bool(password)
+
+        async def call_with_relogin(call):
+            nonlocal token, can_relogin
+            result = await call(token)
+            if result.get('auth_failed') and can_relogin:
+                can_relogin = False
+                new_token = (await self.login(account, password, refresh=True)).get("data", {}).get("token")
+                if new_token:
+                    token = new_token
+                    result = await call(token)
+            return result
+
+        sign_result = await call_with_relogin(lambda t: self.sign(t, account))
+        balance = (await call_with_relogin(lambda t: self.balance(t, account))).get('balance', 0)
+        if balance:
+            withdraw_result = await call_with_relogin(lambda t: self.withdraw(t, str(balance), account=account))
+        else:
+            withdraw_result = {"msg": "无余额"}
+        return {
+            'date': time.strftime('%Y-%m-%d'),
+            'signed': sign_result.get('code') == 0,
+            'sign_msg': sign_result.get('msg', ''),
+            'balance': balance,
+            'withdraw_status': withdraw_result.get('msg', '')
+        }
+
+async def run_accounts(accounts: Iterable[Dict], on_result: Callable[[str, Optional[Dict], Optional[str]], None],
+                       concurrency: int = 100, **client_kwargs):
+    """在一个事件循环中并发处理所有账号
+
+    固定数量的工作协程从队列中取账号，内存占用只与并发数有关，与账号总数无关。
+
+    Args:
+        accounts: 账号列表，每项包含 account 和 password
+        on_result: 回调 on_result(account, entry, error)，成功时 entry 为状态记录，失败时 error 为原因；
+            回调通常会写数据库和日志，在线程池中执行，不阻塞事件循环
+        concurrency: 同时处理的账号数量
+        client_kwargs: 传给 AsyncUpstreamClient 的参数
+    """
+    queue = asyncio.Queue()
+    for acc in accounts:
+        queue.put_nowait(acc)
+
+    async with AsyncUpstreamClient(**client_kwargs) as client:
+        async def worker():
+            while True:
+                try:
+                    acc = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                account = acc['account']
+                try:
+                    login_json = await client.login(account, acc['password'])
+                    token = login_json.get("data", {}).get("token")
+                    if not token:
+                        await client._run_blocking(on_result, account, None, f"自动登录失败: {login_json}")
+                        continue
+                    entry = await client.sign_and_withdraw(account, token, acc['password'])
+                    await client._run_blocking(on_result, account, entry, None)
+                except Exception as e:
+                    await client._run_blocking(on_result, account, None, f"处理异常: {e}")
+
+        await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, queue.qsize())))))
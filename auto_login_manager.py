@@ -8,7 +8,14 @@
 import json
 import time
 import os
+import threading
 import requests
+from concurrent.futures import Future, wait
+from retry_queue import DelayedRetryQueue
+from retry_policy import retry_policy
+from session_pool import session_pool
+from rate_limiter import rate_limiter
+from token_cache import token_cache
 from datetime import datetime, timedelta
 from typing import Dict, Optional, List, Tuple
 
@@ -21,6 +28,13 @@ except ImportError:
     UA_AVAILABLE = False
     print("警告: fake-useragent库未安装，将使用默认User-Agent")
 
+LOGIN_URL = "https://qy.doufp.com/api/auth/login"
+
+# 批量自动登录：同时登录的账号数、单个账号和整批的最长耗时（秒）
+AUTO_LOGIN_CONCURRENCY = int(os.getenv("AUTO_LOGIN_CONCURRENCY", "5"))
+AUTO_LOGIN_ACCOUNT_TIMEOUT = float(os.getenv("AUTO_LOGIN_ACCOUNT_TIMEOUT", "120"))
+AUTO_LOGIN_BATCH_TIMEOUT = float(os.getenv("AUTO_LOGIN_BATCH_TIMEOUT", "600"))
+
 def get_random_user_agent() -> str:
     """获取随机User-Agent"""
     if UA_AVAILABLE:
@@ -36,10 +50,36 @@ def get_default_user_agent() -> str:
     """获取默认User-Agent"""
     return "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
 
+class LoginJob:
+    """一个账号的登录任务，在重试队列中多次尝试，结果通过 future 返回"""
+    
+    def __init__(self, account: str, password: str, max_attempts: int, show_total: bool = False):
+        self.account = account
+        self.max_attempts = max_attempts
+        self.show_total = show_total
+        self.attempt = 0
+        self.deadline = None
+        self.timeout = None
+        self.deadline_cap = None
+        # 构建登录请求数据
+        self.login_data = {
+            "account": account,
+            "password": password
+        }
+        self.headers = {
+            "Content-Type": "application/x-www-form-urlencoded",
+            "User-Agent": get_random_user_agent()
+        }
+        self.future = Future()
+
 class AutoLoginManager:
     def __init__(self, config_file: str = "auto_login_config.json"):
         self.config_file = config_file
         self.config = self.load_config()
+        # 并发登录时多个线程会同时更新配置
+        self._lock = threading.RLock()
+        # 登录尝试在工作线程中执行，退避等待的账号放在重试队列中，不占用工作线程
+        self.retry_queue = DelayedRetryQueue(max_workers=AUTO_LOGIN_CONCURRENCY, name="auto-login")
         
         # 导入代理相关模块
         try:
@@ -88,8 +128,9 @@ class AutoLoginManager:
     def save_config(self):
         """保存自动登录配置"""
         try:
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(self.config, f, ensure_ascii=False, indent=2)
+            with self._lock:
+                with open(self.config_file, 'w', encoding='utf-8') as f:
+                    json.dump(self.config, f, ensure_ascii=False, indent=2)
         except Exception as e:
             print(f"保存自动登录配置失败: {e}")
     
@@ -211,13 +252,14 @@ class AutoLoginManager:
     def update_account_login_date(self, account: str):
         """更新指定账号的登录日期"""
         try:
-            accounts = self.config.get("accounts", [])
-            for acc in accounts:
-                if acc["account"] == account:
-                    acc["last_login_date"] = time.strftime('%Y-%m-%d')
-                    self.save_config()
-                    print(f"已更新账号 {account} 的登录日期")
-                    return True
+            with self._lock:
+                accounts = self.config.get("accounts", [])
+                for acc in accounts:
+                    if acc["account"] == account:
+                        acc["last_login_date"] = time.strftime('%Y-%m-%d')
+                        self.save_config()
+                        print(f"已更新账号 {account} 的登录日期")
+                        return True
             print(f"账号 {account} 不存在")
             return False
         except Exception as e:
@@ -276,275 +318,198 @@ class AutoLoginManager:
             "has_credentials": len(accounts) > 0
         }
 
-    def make_login_request_with_proxy(self, account: str, password: str, max_retries: int = 10) -> Tuple[bool, Dict]:
-        """使用代理发送登录请求，支持失败重试
-        - 网络错误：自动重试（最多max_retries次）
-        - 代理错误：持续重试直至成功或达到最大重试次数
-        - 账号密码错误：不重试，直接返回失败
-        """
-        if not self.proxy_available:
-            # 如果没有代理模块，使用直接连接
-            return self._make_direct_login_request(account, password)
-        
-        # 构建登录请求数据
-        login_data = {
-            "account": account,
-            "password": password
-        }
-        
-        headers = {
-            "Content-Type": "application/x-www-form-urlencoded",
-            "User-Agent": get_random_user_agent()
-        }
-        
-        attempt = 0
-        max_attempts = max_retries * 2  # 增加最大尝试次数，因为代理错误会持续重试
+    @staticmethod
+    def _remaining(deadline: Optional[float]) -> float:
+        """距截止时间（time.monotonic）的剩余秒数，没有截止时间时为无穷大"""
+        return float('inf') if deadline is None else deadline - time.monotonic()
+    
+    def _request_timeout(self, deadline: Optional[float]) -> float:
+        """单次请求超时不超过截止时间"""
+        return max(1.0, min(30.0, self._remaining(deadline)))
+    
+    def _send_login(self, account: str, login_data: Dict, headers: Dict, proxy_config: Optional[Dict],
+                    deadline: Optional[float]):
+        """发送一次登录请求（proxy_config 为空时直接连接）"""
+        rate_limiter.wait(LOGIN_URL, proxy_config['http'] if proxy_config else None)
+        kwargs = {"proxies": proxy_config} if proxy_config else {}
+        return session_pool.request(
+            "POST",
+            LOGIN_URL,
+            account=account,
+            data=login_data,
+            headers=headers,
+            timeout=self._request_timeout(deadline),
+            **kwargs
+        )
+    
+    def _login_attempt(self, job: "LoginJob") -> Optional[Tuple[bool, Dict]]:
+        """执行一次登录尝试
         
-        while attempt < max_attempts:
-            try:
-                # 获取账号专用代理
-                proxy_config = self.get_proxy_config_for_account(account)
-                
-                # 发送请求
-                if proxy_config:
-                    print(f"账号 {account} 使用代理登录 (尝试 {attempt + 1}): {proxy_config.get('http', '')}")
-                    response = requests.post(
-                        "https://qy.doufp.com/api/auth/login",
-                        data=login_data,
-                        headers=headers,
-                        proxies=proxy_config,
-                        timeout=30
-                    )
-                else:
-                    print(f"账号 {account} 直接连接登录 (尝试 {attempt + 1})")
-                    response = requests.post(
-                        "https://qy.doufp.com/api/auth/login",
-                        data=login_data,
-                        headers=headers,
-                        timeout=30
-                    )
-                
-                # 检查响应
-                if response.status_code == 200:
-                    result = response.json()
-                    if result.get("code") == 0 and result.get("data", {}).get("token"):
-                        # 登录成功，标记代理成功
-                        if proxy_config:
-                            self.mark_account_proxy_success(account)
-                        print(f"账号 {account} 登录成功")
-                        return True, result
-                    else:
-                        # 登录失败（账号密码错误等）- 不重试
-                        print(f"账号 {account} 登录失败: {result.get('msg', '未知错误')}")
-                        if proxy_config:
-                            self.mark_account_proxy_failed(account)
-                        return False, result
+        Returns:
+            (是否成功, 登录接口返回)，登录结束（成功或账号密码错误）时返回，需要重试时返回 None
+        """
+        account = job.account
+        progress = f"{job.attempt + 1}/{job.max_attempts}" if job.show_total else f"{job.attempt + 1}"
+        proxy_config = None
+        try:
+            # 获取账号专用代理
+            proxy_config = self.get_proxy_config_for_account(account)
+            
+            # 发送请求
+            if proxy_config:
+                print(f"账号 {account} 使用代理登录 (尝试 {progress}): {proxy_config.get('http', '')}")
+            else:
+                print(f"账号 {account} 直接连接登录 (尝试 {progress})")
+            response = self._send_login(account, job.login_data, job.headers, proxy_config, job.deadline)
+            
+            # 检查响应
+            if response.status_code == 200:
+                result = response.json()
+                if result.get("code") == 0 and result.get("data", {}).get("token"):
+                    # 登录成功，标记代理成功
+                    if proxy_config:
+                        self.mark_account_proxy_success(account)
+                    print(f"账号 {account} 登录成功")
+                    return True, result
                 else:
-                    # HTTP错误 - 网络问题，需要重试
-                    print(f"账号 {account} HTTP错误: {response.status_code}")
+                    # 登录失败（账号密码错误等）- 不重试
+                    print(f"账号 {account} 登录失败: {result.get('msg', '未知错误')}")
                     if proxy_config:
                         self.mark_account_proxy_failed(account)
-                    
-            except requests.exceptions.ProxyError as e:
-                print(f"账号 {account} 代理连接失败 (尝试 {attempt + 1}): {e}")
+                    return False, result
+            else:
+                # HTTP错误 - 网络问题，需要重试
+                print(f"账号 {account} HTTP错误: {response.status_code}")
                 if proxy_config:
                     self.mark_account_proxy_failed(account)
-                    # 代理错误：持续重试，尝试刷新代理
-                    if self.refresh_account_proxy(account):
-                        print(f"账号 {account} 代理已刷新，继续重试...")
-                        attempt += 1
-                        continue
-                    else:
-                        print(f"账号 {account} 无法刷新代理，尝试直接连接...")
-                        # 尝试直接连接
-                        try:
-                            response = requests.post(
-                                "https://qy.doufp.com/api/auth/login",
-                                data=login_data,
-                                headers=headers,
-                                timeout=30
-                            )
-                            if response.status_code == 200:
-                                result = response.json()
-                                if result.get("code") == 0 and result.get("data", {}).get("token"):
-                                    print(f"账号 {account} 直接连接登录成功")
-                                    return True, result
-                                else:
-                                    # 账号密码错误，不重试
-                                    print(f"账号 {account} 直接连接登录失败: {result.get('msg', '未知错误')}")
-                                    return False, result
-                            else:
-                                # HTTP错误，继续重试
-                                print(f"账号 {account} 直接连接HTTP错误: {response.status_code}")
-                        except Exception as direct_e:
-                            print(f"账号 {account} 直接连接也失败: {direct_e}")
-                            # 直接连接也失败，继续重试
                 
-            except requests.exceptions.RequestException as e:
-                print(f"账号 {account} 网络请求失败 (尝试 {attempt + 1}): {e}")
-                if proxy_config:
-                    self.mark_account_proxy_failed(account)
-                # 网络错误：需要重试
-            
-            except requests.exceptions.Timeout as e:
-                print(f"账号 {account} 请求超时 (尝试 {attempt + 1}): {e}")
-                if proxy_config:
-                    self.mark_account_proxy_failed(account)
-                # 超时错误：需要重试
-            
-            except requests.exceptions.ConnectionError as e:
-                print(f"账号 {account} 连接错误 (尝试 {attempt + 1}): {e}")
-                if proxy_config:
-                    self.mark_account_proxy_failed(account)
-                # 连接错误：需要重试
-            
-            except Exception as e:
-                print(f"账号 {account} 未知错误 (尝试 {attempt + 1}): {e}")
-                if proxy_config:
-                    self.mark_account_proxy_failed(account)
-                # 未知错误：需要重试
-            
-            # 增加尝试次数
-            attempt += 1
-            
-            # 等待一段时间后重试（递增等待时间）
-            if attempt < max_attempts:
-                wait_time = min(attempt * 2, 30)  # 最大等待30秒
-                print(f"账号 {account} 等待 {wait_time} 秒后重试...")
-                time.sleep(wait_time)
+        except requests.exceptions.ProxyError as e:
+            print(f"账号 {account} 代理连接失败 (尝试 {progress}): {e}")
+            if proxy_config:
+                self.mark_account_proxy_failed(account)
+                # 代理错误：持续重试，尝试刷新代理
+                if self.refresh_account_proxy(account):
+                    print(f"账号 {account} 代理已刷新，继续重试...")
+                    return None
+                # 直接连接是额外的上游请求，计入重试预算
+                if not retry_policy.allow_fallback():
+                    return None
+                print(f"账号 {account} 无法刷新代理，尝试直接连接...")
+                # 尝试直接连接
+                try:
+                    response = self._send_login(account, job.login_data, job.headers, None, job.deadline)
+                    if response.status_code == 200:
+                        result = response.json()
+                        if result.get("code") == 0 and result.get("data", {}).get("token"):
+                            print(f"账号 {account} 直接连接登录成功")
+                            return True, result
+                        else:
+                            # 账号密码错误，不重试
+                            print(f"账号 {account} 直接连接登录失败: {result.get('msg', '未知错误')}")
+                            return False, result
+                    else:
+                        # HTTP错误，继续重试
+                        print(f"账号 {account} 直接连接HTTP错误: {response.status_code}")
+                except Exception as direct_e:
+                    print(f"账号 {account} 直接连接也失败: {direct_e}")
+                    # 直接连接也失败，继续重试
         
-        print(f"账号 {account} 登录失败，已尝试 {attempt} 次")
-        return False, {"code": -1, "msg": "登录失败，已尝试多次"}
+        except requests.exceptions.RequestException as e:
+            print(f"账号 {account} 网络请求失败 (尝试 {progress}): {e}")
+            if proxy_config:
+                self.mark_account_proxy_failed(account)
+            # 网络错误：需要重试
+        
+        except Exception as e:
+            print(f"账号 {account} 未知错误 (尝试 {progress}): {e}")
+            if proxy_config:
+                self.mark_account_proxy_failed(account)
+            # 未知错误：需要重试
+        
+        return None
     
-    def make_login_request_with_retry_until_success(self, account: str, password: str, max_retries: int = 20) -> Tuple[bool, Dict]:
-        """使用代理发送登录请求，持续重试直至成功
-        - 网络错误：持续重试
-        - 代理错误：持续重试
-        - 账号密码错误：不重试，直接返回失败
-        - 只有在达到最大重试次数或账号密码错误时才停止
-        """
-        if not self.proxy_available:
-            # 如果没有代理模块，使用直接连接
-            return self._make_direct_login_request(account, password)
+    def _run_login_job(self, job: "LoginJob"):
+        """在重试队列的工作线程中执行一次尝试，需要退避时重新放回队列，不在线程中等待"""
+        if job.deadline is None and job.timeout is not None:
+            # 单个账号的截止时间从第一次尝试开始计算
+            job.deadline = time.monotonic() + job.timeout
+        if job.deadline_cap is not None:
+            job.deadline = job.deadline_cap if job.deadline is None else min(job.deadline, job.deadline_cap)
         
-        # 构建登录请求数据
-        login_data = {
-            "account": account,
-            "password": password
-        }
+        if self._remaining(job.deadline) <= 0:
+            print(f"账号 {job.account} 登录超时，已尝试 {job.attempt} 次")
+            job.future.set_result((False, {"code": -1, "msg": "登录超时"}))
+            return
         
-        headers = {
-            "Content-Type": "application/x-www-form-urlencoded",
-            "User-Agent": get_random_user_agent()
-        }
+        try:
+            result = self._login_attempt(job)
+        except Exception as e:
+            result = None
+            print(f"账号 {job.account} 登录尝试异常: {e}")
+        if result is not None:
+            job.future.set_result(result)
+            return
         
-        attempt = 0
+        # 增加尝试次数；达到次数上限或全局重试预算用完时停止
+        job.attempt += 1
+        if not retry_policy.allow_retry(job.attempt, job.max_attempts):
+            print(f"账号 {job.account} 登录失败，已尝试 {job.attempt} 次")
+            job.future.set_result((False, {"code": -1, "msg": "登录失败，已尝试多次"}))
+            return
         
-        while attempt < max_retries:
-            try:
-                # 获取账号专用代理
-                proxy_config = self.get_proxy_config_for_account(account)
-                
-                # 发送请求
-                if proxy_config:
-                    print(f"账号 {account} 使用代理登录 (尝试 {attempt + 1}/{max_retries}): {proxy_config.get('http', '')}")
-                    response = requests.post(
-                        "https://qy.doufp.com/api/auth/login",
-                        data=login_data,
-                        headers=headers,
-                        proxies=proxy_config,
-                        timeout=30
-                    )
-                else:
-                    print(f"账号 {account} 直接连接登录 (尝试 {attempt + 1}/{max_retries})")
-                    response = requests.post(
-                        "https://qy.doufp.com/api/auth/login",
-                        data=login_data,
-                        headers=headers,
-                        timeout=30
-                    )
-                
-                # 检查响应
-                if response.status_code == 200:
-                    result = response.json()
-                    if result.get("code") == 0 and result.get("data", {}).get("token"):
-                        # 登录成功，标记代理成功
-                        if proxy_config:
-                            self.mark_account_proxy_success(account)
-                        print(f"账号 {account} 登录成功")
-                        return True, result
-                    else:
-                        # 登录失败（账号密码错误等）- 不重试
-                        print(f"账号 {account} 登录失败: {result.get('msg', '未知错误')}")
-                        if proxy_config:
-                            self.mark_account_proxy_failed(account)
-                        return False, result
-                else:
-                    # HTTP错误 - 网络问题，需要重试
-                    print(f"账号 {account} HTTP错误: {response.status_code}")
-                    if proxy_config:
-                        self.mark_account_proxy_failed(account)
-                    
-            except requests.exceptions.ProxyError as e:
-                print(f"账号 {account} 代理连接失败 (尝试 {attempt + 1}/{max_retries}): {e}")
-                if proxy_config:
-                    self.mark_account_proxy_failed(account)
-                    # 代理错误：持续重试，尝试刷新代理
-                    if self.refresh_account_proxy(account):
-                        print(f"账号 {account} 代理已刷新，继续重试...")
-                        attempt += 1
-                        continue
-                    else:
-                        print(f"账号 {account} 无法刷新代理，尝试直接连接...")
-                        # 尝试直接连接
-                        try:
-                            response = requests.post(
-                                "https://qy.doufp.com/api/auth/login",
-                                data=login_data,
-                                headers=headers,
-                                timeout=30
-                            )
-                            if response.status_code == 200:
-                                result = response.json()
-                                if result.get("code") == 0 and result.get("data", {}).get("token"):
-                                    print(f"账号 {account} 直接连接登录成功")
-                                    return True, result
-                                else:
-                                    # 账号密码错误，不重试
-                                    print(f"账号 {account} 直接连接登录失败: {result.get('msg', '未知错误')}")
-                                    return False, result
-                            else:
-                                # HTTP错误，继续重试
-                                print(f"账号 {account} 直接连接HTTP错误: {response.status_code}")
-                        except Exception as direct_e:
-                            print(f"账号 {account} 直接连接也失败: {direct_e}")
-                            # 直接连接也失败，继续重试
-                
-            except (requests.exceptions.RequestException, 
-                   requests.exceptions.Timeout, 
-                   requests.exceptions.ConnectionError) as e:
-                print(f"账号 {account} 网络错误 (尝试 {attempt + 1}/{max_retries}): {e}")
-                if proxy_config:
-                    self.mark_account_proxy_failed(account)
-                # 网络错误：需要重试
-            
-            except Exception as e:
-                print(f"账号 {account} 未知错误 (尝试 {attempt + 1}/{max_retries}): {e}")
-                if proxy_config:
-                    self.mark_account_proxy_failed(account)
-                # 未知错误：需要重试
-            
-            # 增加尝试次数
-            attempt += 1
-            
-            # 等待一段时间后重试（递增等待时间）
-            if attempt < max_retries:
-                wait_time = min(attempt * 3, 60)  # 最大等待60秒
-                print(f"账号 {account} 等待 {wait_time} 秒后重试...")
-                time.sleep(wait_time)
+        # 全抖动指数退避（不超过截止时间），等待期间不占用工作线程
+        wait_time = min(retry_policy.backoff(job.attempt), max(self._remaining(job.deadline), 0))
+        print(f"账号 {job.account} 等待 {round(wait_time, 1)} 秒后重试...")
+        self.retry_queue.submit(self._run_login_job, job, delay=wait_time)
+    
+    def submit_login(self, account: str, password: str, retry_until_success: bool = False,
+                     max_attempts: int = 20, deadline: Optional[float] = None, timeout: Optional[float] = None,
+                     deadline_cap: Optional[float] = None) -> Future:
+        """提交登录任务到重试队列，返回 Future，结果为 (是否成功, 登录接口返回)
         
-        print(f"账号 {account} 登录失败，已尝试 {attempt} 次")
-        return False, {"code": -1, "msg": "登录失败，已尝试多次"}
+        重试遵循全局重试策略：全抖动指数退避，且受全进程重试预算限制；
+        有限重试时尝试次数不超过 RETRY_MAX_ATTEMPTS，持续重试时保持原来的上限 max_attempts（默认20次）
+        
+        Args:
+            retry_until_success: 持续重试（使用 max_attempts 作为上限），日志中显示尝试进度（第几次/共几次）
+            max_attempts: 最多尝试次数
+            deadline: 截止时间（time.monotonic）
+            timeout: 从第一次尝试开始计算的最长耗时（秒）
+            deadline_cap: 截止时间的上限（例如整批的截止时间）
+        """
+        if not retry_until_success:
+            max_attempts = min(max_attempts, retry_policy.max_attempts)
+        job = LoginJob(account, password, max_attempts, show_total=retry_until_success)
+        job.deadline, job.timeout, job.deadline_cap = deadline, timeout, deadline_cap
+        retry_policy.record_request()
+        if not self.proxy_available:
+            # 如果没有代理模块，使用直接连接
+            job.future.set_result(self._make_direct_login_request(account, password))
+            return job.future
+        self.retry_queue.submit(self._run_login_job, job)
+        return job.future
+    
+    def make_login_request_with_proxy(self, account: str, password: str, max_retries: int = 10,
+                                      deadline: Optional[float] = None) -> Tuple[bool, Dict]:
+        """使用代理发送登录请求，支持失败重试
+        - 网络错误：自动重试（最多max_retries次）
+        - 代理错误：持续重试直至成功或达到最大重试次数
+        - 账号密码错误：不重试，直接返回失败
+        - 到达截止时间 deadline（time.monotonic）后不再重试
+        """
+        # 增加最大尝试次数，因为代理错误会持续重试
+        return self.submit_login(account, password, max_attempts=max_retries * 2, deadline=deadline).result()
+    
+    def make_login_request_with_retry_until_success(self, account: str, password: str, max_retries: int = 20,
+                                                    deadline: Optional[float] = None) -> Tuple[bool, Dict]:
+        """使用代理发送登录请求，持续重试直至成功
+        - 网络错误：持续重试
+        - 代理错误：持续重试
+        - 账号密码错误：不重试，直接返回失败
+        - 只有在达到最大重试次数、截止时间 deadline 或账号密码错误时才停止
+        """
+        return self.submit_login(account, password, retry_until_success=True, max_attempts=max_retries,
+                                 deadline=deadline).result()
     
     def _make_direct_login_request(self, account: str, password: str) -> Tuple[bool, Dict]:
         """直接连接登录请求（无代理）"""
@@ -559,8 +524,12 @@ class AutoLoginManager:
                 "User-Agent": get_random_user_agent()
             }
             
-            response = requests.post(
-                "https://qy.doufp.com/api/auth/login",
+            rate_limiter.wait(LOGIN_URL)
+            
+            response = session_pool.request(
+                "POST",
+                LOGIN_URL,
+                account=account,
                 data=login_data,
                 headers=headers,
                 timeout=30
@@ -582,25 +551,35 @@ class AutoLoginManager:
             print(f"账号 {account} 直接连接失败: {e}")
             return False, {"code": -1, "msg": f"连接失败: {e}"}
     
-    def auto_login_account(self, account: str, password: str, retry_until_success: bool = False) -> bool:
+    def auto_login_account(self, account: str, password: str, retry_until_success: bool = False,
+                           deadline: Optional[float] = None) -> Tuple[bool, Dict]:
         """自动登录指定账号（带代理重试）
         
         Args:
             account: 账号
             password: 密码
             retry_until_success: 是否持续重试直至成功（默认False，使用有限重试）
+            deadline: 截止时间（time.monotonic），到达后不再重试
+        
+        Returns:
+            (是否成功, 登录接口返回)，成功时 token 在 result["data"]["token"]，调用方直接使用，无需再次登录
         """
         print(f"开始自动登录账号: {account}")
         
         if retry_until_success:
             # 使用持续重试机制
-            success, result = self.make_login_request_with_retry_until_success(account, password, max_retries=20)
+            success, result = self.make_login_request_with_retry_until_success(account, password, max_retries=20, deadline=deadline)
         else:
             # 使用有限重试机制
-            success, result = self.make_login_request_with_proxy(account, password, max_retries=10)
-        
+            success, result = self.make_login_request_with_proxy(account, password, max_retries=10, deadline=deadline)
+        return self._finish_auto_login(account, password, success, result), result
+    
+    def _finish_auto_login(self, account: str, password: str, success: bool, result: Dict) -> bool:
+        """处理自动登录结果"""
         if success:
-            # 登录成功，更新登录日期
+            # 登录成功，缓存token供后续签到等接口复用
+            token_cache.set(account, result["data"]["token"], password)
+            # 更新登录日期
             self.update_account_login_date(account)
             print(f"账号 {account} 自动登录成功")
             return True
@@ -608,11 +587,15 @@ class AutoLoginManager:
             print(f"账号 {account} 自动登录失败: {result.get('msg', '未知错误')}")
             return False
     
-    def auto_login_all_accounts(self, retry_until_success: bool = False) -> Dict[str, bool]:
-        """自动登录所有启用的账号
+    def auto_login_all_accounts(self, retry_until_success: bool = False,
+                                account_timeout: float = AUTO_LOGIN_ACCOUNT_TIMEOUT,
+                                batch_timeout: float = AUTO_LOGIN_BATCH_TIMEOUT) -> Dict[str, bool]:
+        """并发自动登录所有启用的账号（同时登录的账号数由重试队列的工作线程数 AUTO_LOGIN_CONCURRENCY 决定）
         
         Args:
             retry_until_success: 是否持续重试直至成功（默认False，使用有限重试）
+            account_timeout: 单个账号最长耗时（秒），超时后不再重试
+            batch_timeout: 整批最长耗时（秒），到时仍未完成的账号记为失败
         """
         results = {}
         enabled_accounts = self.get_enabled_accounts()
@@ -623,17 +606,36 @@ class AutoLoginManager:
         
         print(f"开始自动登录 {len(enabled_accounts)} 个账号...")
         
+        pending = []
         for account_info in enabled_accounts:
-            account = account_info["account"]
-            password = account_info["password"]
-            
             # 检查是否需要登录
             if self.should_account_login(account_info):
-                success = self.auto_login_account(account, password, retry_until_success)
-                results[account] = success
+                pending.append(account_info)
+            else:
+                print(f"账号 {account_info['account']} 今天已经登录过，跳过")
+                results[account_info["account"]] = True  # 标记为成功（已登录）
+        if not pending:
+            return results
+        
+        batch_deadline = time.monotonic() + batch_timeout
+        
+        # 单个账号的截止时间从第一次尝试开始计算，且不晚于整批的截止时间
+        futures = {}
+        for account_info in pending:
+            account = account_info["account"]
+            print(f"开始自动登录账号: {account}")
+            futures[self.submit_login(account, account_info["password"], retry_until_success,
+                                      timeout=account_timeout, deadline_cap=batch_deadline)] = account_info
+        done, _ = wait(futures, timeout=max(batch_deadline - time.monotonic(), 0))
+        
+        # 未完成的账号会在截止时间后自行结束
+        for future, account_info in futures.items():
+            account = account_info["account"]
+            if future in done:
+                results[account] = self._finish_auto_login(account, account_info["password"], *future.result())
             else:
-                print(f"账号 {account} 今天已经登录过，跳过")
-                results[account] = True  # 标记为成功（已登录）
+                print(f"账号 {account} 自动登录未在时限内完成")
+                results[account] = False
         
         return results
 
@@ -680,9 +682,10 @@ def get_auto_login_status() -> Dict:
     """获取自动登录状态（便捷函数）"""
     return auto_login_manager.get_status()
 
-def auto_login_account(account: str, password: str, retry_until_success: bool = False) -> bool:
+def auto_login_account(account: str, password: str, retry_until_success: bool = False,
+                       deadline: Optional[float] = None) -> Tuple[bool, Dict]:
     """自动登录指定账号（便捷函数）"""
-    return auto_login_manager.auto_login_account(account, password, retry_until_success)
+    return auto_login_manager.auto_login_account(account, password, retry_until_success, deadline)
 
 def auto_login_all_accounts(retry_until_success: bool = False) -> Dict[str, bool]:
     """自动登录所有启用的账号（便捷函数）"""
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+代理熔断器
+每个代理一个熔断器：最近若干次请求的失败率超过阈值时打开（停止使用该代理），
+冷却一段时间后进入半开状态，只放行一个探测请求，成功则恢复、失败则再次打开
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Hashable, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitBreaker:
+    def __init__(self, window_size: int = 10, failure_rate: float = 0.5, min_calls: int = 3,
+                 cooldown: float = 60):
+        """
+        Args:
+            window_size: 统计失败率的最近请求数
+            failure_rate: 失败率达到该值时打开
+            min_calls: 窗口内至少有这么多次请求才判断失败率
+            cooldown: 打开后多久进入半开状态（秒），也是探测请求未回报结果时的超时
+        """
+        self.window_size = window_size
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._window = deque(maxlen=window_size)
+        self._probe_started = None
+
+    def _refresh(self, now: float):
+        if self.state == OPEN and now - self.opened_at >= self.cooldown:
+            self.state = HALF_OPEN
+            self._probe_started = None
+        elif self.state == HALF_OPEN and self._probe_started is not None and now - self._probe_started >= self.cooldown:
+            # 探测请求一直没有结果，允许重新探测
+            self._probe_started = None
+
+    def available(self, now: Optional[float] = None) -> bool:
+        """当前是否可以发送请求（只查询，不占用半开状态的探测名额）"""
+        self._refresh(time.time() if now is None else now)
+        return self.state == CLOSED or (self.state == HALF_OPEN and self._probe_started is None)
+
+    def allow_request(self, now: Optional[float] = None) -> bool:
+        """请求前调用：关闭状态直接放行；半开状态只放行一个探测请求"""
+        now = time.time() if now is None else now
+        if not self.available(now):
+            return False
+        if self.state == HALF_OPEN:
+            self._probe_started = now
+        return True
+
+    def retry_at(self) -> float:
+        """不可用时，预计恢复可用（可以探测）的时间"""
+        if self.state == OPEN:
+            return self.opened_at + self.cooldown
+        if self.state == HALF_OPEN and self._probe_started is not None:
+            return self._probe_started + self.cooldown
+        return 0.0
+
+    def record_success(self):
+        if self.state == HALF_OPEN:
+            # 探测成功，恢复正常
+            self.state = CLOSED
+            self._window.clear()
+            self._probe_started = None
+        self._window.append(True)
+
+    def record_failure(self, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        if self.state == HALF_OPEN:
+            self._open(now)
+            return
+        self._window.append(False)
+        failures = self._window.count(False)
+        if len(self._window) >= self.min_calls and failures / len(self._window) >= self.failure_rate:
+            self._open(now)
+
+    def _open(self, now: float):
+        self.state = OPEN
+        self.opened_at = now
+        self._probe_started = None
+        self._window.clear()
+
+class CircuitBreakerRegistry:
+    """按 key（如代理的 (ip, port)）管理熔断器，线程安全"""
+
+    def __init__(self, **breaker_kwargs):
+        self.breaker_kwargs = breaker_kwargs
+        self._breakers: Dict[Hashable, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key: Hashable) -> CircuitBreaker:
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = self._breakers[key] = CircuitBreaker(**self.breaker_kwargs)
+        return breaker
+
+    def available(self, key: Hashable) -> bool:
+        with self._lock:
+            return self._get(key).available()
+
+    def allow_request(self, key: Hashable) -> bool:
+        with self._lock:
+            return self._get(key).allow_request()
+
+    def retry_at(self, key: Hashable) -> float:
+        with self._lock:
+            return self._get(key).retry_at()
+
+    def record(self, key: Hashable, success: bool):
+        with self._lock:
+            breaker = self._get(key)
+            if success:
+                breaker.record_success()
+            else:
+                breaker.record_failure()
+
+    def state(self, key: Hashable) -> str:
+        with self._lock:
+            breaker = self._get(key)
+            breaker.available()
+            return breaker.state
+
+# 全局代理熔断器（ProxyManager 和 AccountProxyManager 共用，按 (ip, port) 区分）
+proxy_breakers = CircuitBreakerRegistry(
+    window_size=int(os.getenv("PROXY_BREAKER_WINDOW", "10")),
+    failure_rate=float(os.getenv("PROXY_BREAKER_FAILURE_RATE", "0.5")),
+    min_calls=int(os.getenv("PROXY_BREAKER_MIN_CALLS", "3")),
+    cooldown=float(os.getenv("PROXY_BREAKER_COOLDOWN", "60"))
+)
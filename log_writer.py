@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+异步日志写入
+调用方只把日志行放入队列，由后台线程批量写入文件，
+支持按大小或按天轮转，多进程通过文件锁互斥写入和轮转；
+另提供从文件末尾/指定偏移读取的函数，供日志接口增量查询
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+class BufferedLogWriter:
+    def __init__(self, log_file: str, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5,
+                 rotate_when: str = "size", flush_interval: float = 1.0, batch_size: int = 500):
+        """
+        Args:
+            log_file: 日志文件
+            max_bytes: 按大小轮转时单个文件的最大字节数
+            backup_count: 保留的历史文件数量
+            rotate_when: size（按大小）或 daily（按天）
+            flush_interval: 后台线程最长多久写一次文件（秒）
+            batch_size: 每批最多写入的行数
+        """
+        self.log_file = log_file
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.rotate_when = rotate_when
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def _ensure_started(self):
+        """按需启动写入线程；gunicorn fork 后在子进程中重新启动"""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+
+    def write(self, line: str):
+        """写入一行日志（只入队，不做文件IO）"""
+        self._ensure_started()
+        self._queue.put_nowait(line)
+
+    def _drain(self, block: bool) -> List[str]:
+        lines = []
+        try:
+            lines.append(self._queue.get(timeout=self.flush_interval) if block else self._queue.get_nowait())
+            while len(lines) < self.batch_size:
+                lines.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return lines
+
+    def _run(self):
+        while True:
+            lines = self._drain(block=True)
+            if lines:
+                self._write_lines(lines)
+
+    @contextmanager
+    def _file_lock(self):
+        """跨进程互斥（Windows 下无 fcntl，不加锁）"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.log_file + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_lines(self, lines: List[str]):
+        try:
+            with self._file_lock():
+                if self._should_rotate():
+                    self._rotate()
+                with open(self.log_file, "a", encoding="utf-8") as f:
+                    f.write("".join(lines))
+        except Exception as e:
+            print(f"写入日志失败: {e}")
+        finally:
+            for _ in lines:
+                self._queue.task_done()
+
+    def _should_rotate(self) -> bool:
+        if not os.path.exists(self.log_file):
+            return False
+        if self.rotate_when == "daily":
+            return time.strftime('%Y-%m-%d', time.localtime(os.path.getmtime(self.log_file))) != time.strftime('%Y-%m-%d')
+        return os.path.getsize(self.log_file) >= self.max_bytes
+
+    def _rotate(self):
+        """轮转日志：按天时重命名为 文件名.日期，按大小时依次后移 .1 .2 ..."""
+        if self.rotate_when == "daily":
+            date = time.strftime('%Y-%m-%d', time.localtime(os.path.getmtime(self.log_file)))
+            os.replace(self.log_file, f"{self.log_file}.{date}")
+            prefix = os.path.basename(self.log_file) + "."
+            directory = os.path.dirname(self.log_file) or "."
+            backups = sorted(n for n in os.listdir(directory) if n.startswith(prefix) and n != prefix + "lock")
+            for name in backups[:-self.backup_count] if self.backup_count else backups:
+                os.remove(os.path.join(directory, name))
+            return
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.log_file}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.log_file}.{i + 1}")
+        if self.backup_count:
+            os.replace(self.log_file, f"{self.log_file}.1")
+        else:
+            os.remove(self.log_file)
+
+    def flush(self):
+        """同步写出队列中剩余的日志"""
+        lines = self._drain(block=False)
+        while lines:
+            self._write_lines(lines)
+            lines = self._drain(block=False)
+
+def _decode_lines(lines: List[bytes]) -> List[str]:
+    return [line.decode("utf-8", errors="replace").replace("\r\n", "\n") for line in lines]
+
+def _file_id(f) -> int:
+    """文件标识（inode），日志轮转后新文件的标识不同；不支持 inode 的平台为 0"""
+    return os.fstat(f.fileno()).st_ino
+
+def tail_lines(path: str, n: int = 50, block_size: int = 8192) -> Tuple[List[str], int, int]:
+    """从文件末尾按块向前读取最后 n 个完整行，返回 (行列表, 最后一个完整行之后的偏移, 文件标识)
+
+    读取量只与返回的行数有关，与文件大小无关。末尾还在写入的不完整行不返回，
+    返回的偏移停在它之前，下次 read_since 时完整读出。
+    """
+    with open(path, "rb") as f:
+        file_id = _file_id(f)
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        pos = end
+        data = b""
+        # 多读一个换行符，保证第一行是完整的
+        while pos > 0 and data.count(b"\n") <= n:
+            read_size = min(block_size, pos)
+            pos -= read_size
+            f.seek(pos)
+            data = f.read(read_size) + data
+    # 去掉末尾不完整的行
+    data = data[:data.rfind(b"\n") + 1]
+    end = pos + len(data)
+    lines = data.splitlines(keepends=True)
+    if pos > 0:
+        lines = lines[1:]
+    return (_decode_lines(lines[-n:]) if n > 0 else []), end, file_id
+
+def read_since(path: str, offset: int, max_lines: int = 500, block_size: int = 8192,
+               file_id: Optional[int] = None) -> Tuple[List[str], int, int]:
+    """从偏移 offset 开始读取新增的完整行（最多 max_lines 行），返回 (行列表, 新偏移, 文件标识)
+
+    传入上次返回的 file_id 且与当前文件不同（日志已轮转），或 offset 超出文件大小（文件被截断）时，
+    当前文件的内容都是上次读取之后写入的，从文件开头读取。
+    """
+    lines = []
+    with open(path, "rb") as f:
+        current_id = _file_id(f)
+        if (file_id is not None and file_id != current_id) or offset > os.fstat(f.fileno()).st_size:
+            offset = 0
+        f.seek(offset)
+        buffer = b""
+        while len(lines) < max_lines:
+            chunk = f.read(block_size)
+            if not chunk:
+                break
+            buffer += chunk
+            parts = buffer.split(b"\n")
+            buffer = parts.pop()
+            for part in parts:
+                if len(lines) >= max_lines:
+                    break
+                lines.append(part + b"\n")
+    new_offset = offset + sum(len(line) for line in lines)
+    return _decode_lines(lines), new_offset, current_id
@@ -7,13 +7,25 @@
 
 import requests
 import json
+import os
 import time
 import re
+import threading
+from collections import deque
 from typing import List, Dict, Optional
-from proxy_config import ProxyManager
+from proxy_config import ProxyManager, proxy_manager as shared_proxy_manager, measure_proxy, validate_proxies, within_latency
+from proxy_selector import PROXY_LEASE_MARGIN, is_lease_expired
+from rate_limiter import rate_limiter
+
+# [用户名:密码@]IP:PORT，匹配任意分隔符（换行、逗号、分号、空格等）分开的代理
+PROXY_PATTERN = re.compile(r'(?:([^\s:@,;|]+):([^\s:@,;|]+)@)?(\d{1,3}(?:\.\d{1,3}){3}):(\d{1,5})')
 
 class ProxyAPI:
-    def __init__(self):
+    def __init__(self, proxy_manager: Optional[ProxyManager] = None):
+        """
+        Args:
+            proxy_manager: 获取到的代理加入的代理池，默认使用全局共享的 proxy_config.proxy_manager
+        """
         # 代理API配置
         self.api_url = "http://api.xiequ.cn/VAD/GetIp.aspx"
         self.api_params = {
@@ -32,24 +44,65 @@ class ProxyAPI:
             "addr": "",
             "db": "1"
         }
-        self.proxy_manager = ProxyManager()
+        # 代理有效期：api_params 中 time 为有效分钟数
+        self.lease_seconds = float(os.getenv("PROXY_LEASE_SECONDS", str(int(self.api_params["time"]) * 60)))
+        self.proxy_manager = proxy_manager or shared_proxy_manager
+        # 后台预取并验证代理，分配时直接从池中取
+        self.prefetch_pool = ProxyPrefetchPool(
+            self,
+            low_water=int(os.getenv("PROXY_POOL_LOW_WATER", "3")),
+            batch_size=int(os.getenv("PROXY_POOL_BATCH", "5")),
+            idle_timeout=float(os.getenv("PROXY_POOL_IDLE_TIMEOUT", "300"))
+        )
+    
+    def _stamp_lease(self, proxy_info: Dict) -> Dict:
+        """记录代理的获取时间和租约时长"""
+        proxy_info['acquired_at'] = time.time()
+        proxy_info['lease_seconds'] = self.lease_seconds
+        return proxy_info
+    
+    def get_proxies_from_api(self, num: int = 1) -> List[Dict]:
+        """从API批量获取代理IP（一次请求 num 个）"""
+        try:
+            print(f"🔄 从API获取 {num} 个代理IP: {self.api_url}")
+            
+            rate_limiter.wait(self.api_url)
+            params = dict(self.api_params, num=str(num))
+            response = requests.get(self.api_url, params=params, timeout=10)
+            
+            if response.status_code == 200:
+                content = response.text.strip()
+                print(f"API返回内容: {content}")
+                
+                proxies = [self._stamp_lease(p) for p in self.parse_proxy_response(content)]
+                print(f"✅ 成功获取 {len(proxies)} 个代理")
+                return proxies
+            else:
+                print(f"❌ API请求失败: {response.status_code}")
+                
+        except Exception as e:
+            print(f"❌ 获取代理IP失败: {e}")
+        
+        return []
     
     def get_proxy_from_api(self) -> Optional[Dict]:
         """从API获取代理IP"""
         try:
             print(f"🔄 从API获取代理IP: {self.api_url}")
             
+            rate_limiter.wait(self.api_url)
             response = requests.get(self.api_url, params=self.api_params, timeout=10)
             
             if response.status_code == 200:
                 content = response.text.strip()
                 print(f"API返回内容: {content}")
                 
-                # 解析返回的代理IP
-                proxy_info = self.parse_proxy_response(content)
-                if proxy_info:
+                # 解析返回的代理IP（只取第一个）
+                proxies = self.parse_proxy_response(content)
+                if proxies:
+                    proxy_info = proxies[0]
                     print(f"✅ 成功获取代理: {proxy_info['ip']}:{proxy_info['port']}")
-                    return proxy_info
+                    return self._stamp_lease(proxy_info)
                 else:
                     print("❌ 无法解析代理IP")
             else:
@@ -60,101 +113,86 @@ class ProxyAPI:
         
         return None
     
-    def parse_proxy_response(self, content: str) -> Optional[Dict]:
-        """解析API返回的代理IP"""
+    def parse_proxy_response(self, content: str) -> List[Dict]:
+        """解析API返回的所有代理IP
+        
+        支持 JSON（单个对象、数组或 data 字段中的数组）以及
+        按换行、逗号、分号、空格等分隔的 [用户名:密码@]IP:PORT 文本，一次扫描返回全部代理
+        """
         try:
-            # 尝试不同的解析方式
-            
-            # 方式1: 直接是IP:PORT格式
-            if re.match(r'^\d+\.\d+\.\d+\.\d+:\d+$', content):
-                ip, port = content.split(':')
-                return {
-                    "ip": ip,
-                    "port": int(port),
-                    "type": "http",
-                    "username": "",
-                    "password": ""
-                }
-            
-            # 方式2: JSON格式
-            try:
-                data = json.loads(content)
-                if isinstance(data, dict):
-                    # 查找IP和端口字段
-                    ip = data.get('ip') or data.get('proxy_ip') or data.get('host')
-                    port = data.get('port') or data.get('proxy_port')
-                    
-                    if ip and port:
-                        return {
-                            "ip": ip,
-                            "port": int(port),
-                            "type": "http",
-                            "username": data.get('username', ''),
-                            "password": data.get('password', '')
-                        }
-            except json.JSONDecodeError:
-                pass
-            
-            # 方式3: 其他格式，尝试正则匹配
-            ip_pattern = r'(\d+\.\d+\.\d+\.\d+)'
-            port_pattern = r':(\d+)'
-            
-            ip_match = re.search(ip_pattern, content)
-            port_match = re.search(port_pattern, content)
+            content = content.strip()
+            if content[:1] in ('[', '{'):
+                try:
+                    proxies = self._parse_json_proxies(json.loads(content))
+                    if proxies:
+                        return proxies
+                except json.JSONDecodeError:
+                    pass
+                # JSON 中没有可识别的代理字段（例如 data 为 "IP:PORT" 字符串）时按文本扫描
             
-            if ip_match and port_match:
-                return {
-                    "ip": ip_match.group(1),
-                    "port": int(port_match.group(1)),
-                    "type": "http",
-                    "username": "",
-                    "password": ""
-                }
+            proxies = []
+            seen = set()
+            for match in PROXY_PATTERN.finditer(content):
+                username, password, ip, port = match.groups()
+                if (ip, port) in seen:
+                    continue
+                seen.add((ip, port))
+                proxies.append(self._make_proxy(ip, port, username or "", password or ""))
             
-            # 方式4: 如果内容包含多个IP，取第一个
-            lines = content.split('\n')
-            for line in lines:
-                line = line.strip()
-                if re.match(r'^\d+\.\d+\.\d+\.\d+:\d+$', line):
-                    ip, port = line.split(':')
-                    return {
-                        "ip": ip,
-                        "port": int(port),
-                        "type": "http",
-                        "username": "",
-                        "password": ""
-                    }
-            
-            print(f"无法解析的API响应格式: {content}")
-            return None
+            if not proxies:
+                print(f"无法解析的API响应格式: {content}")
+            return proxies
             
         except Exception as e:
             print(f"解析代理响应失败: {e}")
-            return None
+            return []
+    
+    @staticmethod
+    def _make_proxy(ip: str, port, username: str = "", password: str = "") -> Dict:
+        return {
+            "ip": ip,
+            "port": int(port),
+            "type": "http",
+            "username": username,
+            "password": password
+        }
+    
+    def _parse_json_proxies(self, data) -> List[Dict]:
+        """从JSON中提取代理（对象中的 ip/proxy_ip/host 和 port/proxy_port 字段）"""
+        if isinstance(data, dict):
+            items = data.get('data') if isinstance(data.get('data'), list) else [data]
+        elif isinstance(data, list):
+            items = data
+        else:
+            return []
+        proxies = []
+        for item in items:
+            if isinstance(item, str):
+                match = PROXY_PATTERN.search(item)
+                if match:
+                    username, password, ip, port = match.groups()
+                    proxies.append(self._make_proxy(ip, port, username or "", password or ""))
+                continue
+            if not isinstance(item, dict):
+                continue
+            ip = item.get('ip') or item.get('proxy_ip') or item.get('host')
+            port = item.get('port') or item.get('proxy_port')
+            if ip and port:
+                proxies.append(self._make_proxy(ip, port, item.get('username', ''), item.get('password', '')))
+        return proxies
     
     def test_proxy(self, proxy_info: Dict) -> bool:
-        """测试代理是否可用"""
-        try:
-            proxy_url = f"http://{proxy_info['ip']}:{proxy_info['port']}"
-            proxies = {
-                "http": proxy_url,
-                "https": proxy_url
-            }
-            
-            print(f"🧪 测试代理: {proxy_url}")
-            response = requests.get("http://httpbin.org/ip", proxies=proxies, timeout=10)
-            
-            if response.status_code == 200:
-                result = response.json()
-                print(f"✅ 代理测试成功: {result}")
-                return True
-            else:
-                print(f"❌ 代理测试失败: HTTP {response.status_code}")
-                return False
-                
-        except Exception as e:
-            print(f"❌ 代理测试异常: {e}")
-            return False
+        """测试代理是否可用且延迟不超过 PROXY_MAX_LATENCY_MS（与批量验证一致），测得的延迟记录在代理信息上"""
+        print(f"🧪 测试代理: {proxy_info['ip']}:{proxy_info['port']}")
+        if measure_proxy(proxy_info) and within_latency(proxy_info):
+            print(f"✅ 代理测试成功: 连接 {proxy_info.get('connect_ms')}ms, 首字节 {proxy_info.get('ttfb_ms')}ms")
+            return True
+        print("❌ 代理测试失败")
+        return False
+    
+    def test_proxies(self, proxies: List[Dict]) -> List[Dict]:
+        """并发测试多个代理，返回可用且延迟达标的代理"""
+        return validate_proxies(proxies)
     
     def add_proxy_to_manager(self, proxy_info: Dict):
         """将代理添加到管理器"""
@@ -164,49 +202,164 @@ class ProxyAPI:
                 port=proxy_info['port'],
                 username=proxy_info.get('username', ''),
                 password=proxy_info.get('password', ''),
-                proxy_type=proxy_info.get('type', 'http')
+                proxy_type=proxy_info.get('type', 'http'),
+                **{k: proxy_info[k] for k in ('connect_ms', 'ttfb_ms', 'checked_at', 'acquired_at', 'lease_seconds') if k in proxy_info}
             )
             print(f"✅ 代理已添加到管理器: {proxy_info['ip']}:{proxy_info['port']}")
         except Exception as e:
             print(f"❌ 添加代理到管理器失败: {e}")
     
-    def auto_update_proxy(self, max_retries: int = 3):
-        """自动更新代理"""
+    def auto_update_proxy(self, max_retries: int = 3, batch_size: int = 5):
+        """自动更新代理：每次批量获取一批代理并发验证，加入所有可用的代理
+        
+        API请求的间隔由全局限速器控制，不再固定等待
+        """
         print("🔄 开始自动更新代理...")
         
         for attempt in range(max_retries):
             print(f"尝试 {attempt + 1}/{max_retries}")
             
             # 获取代理
-            proxy_info = self.get_proxy_from_api()
-            if not proxy_info:
-                print("获取代理失败，等待重试...")
-                time.sleep(5)
+            proxies = self.get_proxies_from_api(batch_size)
+            if not proxies:
+                print("获取代理失败，重试...")
                 continue
             
-            # 测试代理
-            if self.test_proxy(proxy_info):
+            # 并发测试代理
+            valid = self.test_proxies(proxies)
+            if valid:
                 # 添加到管理器
-                self.add_proxy_to_manager(proxy_info)
-                print("✅ 代理更新成功")
+                for proxy_info in valid:
+                    self.add_proxy_to_manager(proxy_info)
+                print(f"✅ 代理更新成功，新增 {len(valid)} 个代理")
                 return True
             else:
-                print("代理测试失败，尝试下一个...")
-                time.sleep(2)
+                print("本批代理均不可用，尝试下一批...")
         
         print("❌ 所有尝试都失败")
         return False
     
     def get_and_test_proxy(self) -> Optional[Dict]:
-        """获取并测试代理"""
+        """获取并测试代理（优先从预取池中取已验证的代理）
+        
+        请求路径（分配、刷新、临时借用代理）每次调用都登记预取池的临时需求，
+        池为空的这一次同步获取，此后空闲超时前的调用直接从池中弹出
+        """
+        self.prefetch_pool.touch()
+        proxy_info = self.prefetch_pool.pop()
+        if proxy_info:
+            return proxy_info
+        
+        # 预取池为空时同步获取
         proxy_info = self.get_proxy_from_api()
         if proxy_info and self.test_proxy(proxy_info):
             return proxy_info
         return None
 
+class ProxyPrefetchPool:
+    """代理预取池
+    有需求时（start() 与 stop() 之间，例如定时任务运行期间；或请求路径分配代理后 idle_timeout 秒内）
+    后台线程按批（num=batch_size）从API获取代理并验证，保持至少 low_water 个可用代理，分配代理时直接弹出；
+    没有需求时线程退出并丢弃池中代理，不在空闲时持续购买代理
+    """
+    
+    def __init__(self, proxy_api: ProxyAPI, low_water: int = 3, batch_size: int = 5, retry_interval: float = 10,
+                 idle_timeout: float = 300):
+        self.proxy_api = proxy_api
+        self.low_water = low_water
+        self.batch_size = batch_size
+        self.retry_interval = retry_interval
+        self.idle_timeout = idle_timeout
+        self._ready = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._demand = 0
+        # 请求路径登记的临时需求到期时间
+        self._idle_until = 0.0
+    
+    def _ensure_thread(self):
+        """需要时启动后台预取线程（调用方持有 _lock）"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="proxy-prefetch", daemon=True)
+            self._thread.start()
+    
+    def start(self):
+        """登记一次需求，需要时启动后台预取线程"""
+        with self._lock:
+            self._demand += 1
+            self._ensure_thread()
+    
+    def stop(self):
+        """撤销一次需求；没有需求时线程退出，并丢弃池中代理"""
+        with self._lock:
+            self._demand = max(self._demand - 1, 0)
+            if self._active_locked():
+                return
+            self._ready.clear()
+        self._wakeup.set()
+    
+    def touch(self):
+        """请求路径需要代理时登记临时需求，idle_timeout 秒内没有新的请求后自动撤销"""
+        if self.idle_timeout <= 0:
+            return
+        with self._lock:
+            self._idle_until = time.time() + self.idle_timeout
+            self._ensure_thread()
+    
+    def _active_locked(self) -> bool:
+        return self._demand > 0 or time.time() < self._idle_until
+    
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._active_locked():
+                    # 需求已撤销或空闲超时，丢弃池中代理并退出
+                    self._ready.clear()
+                    self._thread = None
+                    return
+            if self.size() < self.low_water:
+                if self.fill() == 0:
+                    # 获取失败，稍后再试，避免频繁请求API
+                    self._wakeup.wait(self.retry_interval)
+                    self._wakeup.clear()
+                continue
+            self._wakeup.wait(self.retry_interval)
+            self._wakeup.clear()
+    
+    def fill(self) -> int:
+        """获取一批代理，验证后放入池中，返回新增数量"""
+        valid = self.proxy_api.test_proxies(self.proxy_api.get_proxies_from_api(self.batch_size))
+        with self._lock:
+            if self._active_locked():
+                self._ready.extend(valid)
+        return len(valid)
+    
+    def pop(self) -> Optional[Dict]:
+        """取出一个已验证且租约未到期的代理，池为空（或未在预取）时返回 None"""
+        with self._lock:
+            proxy_info = None
+            while self._ready:
+                proxy_info = self._ready.popleft()
+                if not is_lease_expired(proxy_info, PROXY_LEASE_MARGIN):
+                    break
+                # 在池中等待期间租约已到期，丢弃
+                proxy_info = None
+            remaining = len(self._ready)
+        if remaining < self.low_water:
+            self._wakeup.set()
+        return proxy_info
+    
+    def size(self) -> int:
+        with self._lock:
+            return len(self._ready)
+
+# 全局代理API实例（使用共享代理池）
+proxy_api = ProxyAPI()
+
 def main():
     """测试代理API"""
-    api = ProxyAPI()
+    api = proxy_api
     
     print("🔧 代理API测试工具")
     print("=" * 50)
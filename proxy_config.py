@@ -6,38 +6,221 @@
 """
 
 import os
+import atexit
+import heapq
 import json
-import random
-from typing import Dict, List, Optional
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 
-class ProxyManager:
-    def __init__(self, config_file: str = "proxy_list.json"):
+from circuit_breaker import CircuitBreakerRegistry, proxy_breakers
+from proxy_selector import (PROXY_AGE_HALF_LIFE, PROXY_LEASE_MARGIN, WeightedIndex, is_lease_expired,
+                            proxy_score, update_success_rate)
+
+PROXY_TEST_URL = "http://httpbin.org/ip"
+# 连接或首字节延迟超过该值（毫秒）的代理视为过慢
+PROXY_MAX_LATENCY_MS = float(os.getenv("PROXY_MAX_LATENCY_MS", "3000"))
+# 代理状态变化后最多延迟多久写入文件（秒）
+PROXY_SAVE_INTERVAL = float(os.getenv("PROXY_SAVE_INTERVAL", "5"))
+
+def proxy_key(proxy: Dict) -> Tuple[str, str]:
+    """代理的唯一标识 (ip, port)，端口统一为字符串（API返回的端口可能是字符串）"""
+    return proxy['ip'], str(proxy['port'])
+
+def build_proxy_url(proxy: Dict) -> str:
+    """构建代理URL"""
+    proxy_type = proxy.get('type', 'http')
+    if proxy.get('username') and proxy.get('password'):
+        return f"{proxy_type}://{proxy['username']}:{proxy['password']}@{proxy['ip']}:{proxy['port']}"
+    return f"{proxy_type}://{proxy['ip']}:{proxy['port']}"
+
+def build_proxies(proxy: Optional[Dict]) -> Optional[Dict]:
+    """构建 requests 使用的 proxies 参数，代理为空时返回 None"""
+    if not proxy:
+        return None
+    proxy_url = build_proxy_url(proxy)
+    return {
+        "http": proxy_url,
+        "https": proxy_url
+    }
+
+def measure_proxy(proxy: Dict, timeout: float = 10, test_url: str = PROXY_TEST_URL) -> bool:
+    """测试代理并把延迟记录到代理信息上
+    
+    记录字段: connect_ms（TCP连接代理耗时）、ttfb_ms（经代理请求到收到响应头的耗时）、checked_at
+    """
+    import requests
+    
+    proxy['checked_at'] = time.time()
+    try:
+        start = time.monotonic()
+        with socket.create_connection((proxy['ip'], int(proxy['port'])), timeout=timeout):
+            proxy['connect_ms'] = round((time.monotonic() - start) * 1000, 1)
+        
+        proxy_url = build_proxy_url(proxy)
+        start = time.monotonic()
+        with requests.get(test_url, proxies={"http": proxy_url, "https": proxy_url}, timeout=timeout, stream=True) as response:
+            proxy['ttfb_ms'] = round((time.monotonic() - start) * 1000, 1)
+            return response.status_code == 200
+    except Exception as e:
+        print(f"代理测试失败: {proxy['ip']}:{proxy['port']} - {e}")
+        proxy.pop('connect_ms', None)
+        proxy.pop('ttfb_ms', None)
+        return False
+
+def within_latency(proxy: Dict, max_latency_ms: Optional[float] = None) -> bool:
+    """测得的连接和首字节延迟是否都不超过阈值（默认 PROXY_MAX_LATENCY_MS）"""
+    max_latency_ms = PROXY_MAX_LATENCY_MS if max_latency_ms is None else max_latency_ms
+    if max(proxy.get('connect_ms', 0), proxy.get('ttfb_ms', 0)) > max_latency_ms:
+        print(f"代理过慢，已丢弃: {proxy['ip']}:{proxy['port']} (首字节 {proxy.get('ttfb_ms')}ms)")
+        return False
+    return True
+
+def validate_proxies(proxies: List[Dict], max_workers: int = 10, max_latency_ms: Optional[float] = None,
+                     timeout: float = 10) -> List[Dict]:
+    """并发验证多个代理，返回可用且延迟不超过阈值的代理（按首字节延迟从低到高）"""
+    if not proxies:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(proxies))) as executor:
+        results = list(executor.map(lambda p: measure_proxy(p, timeout), proxies))
+    
+    valid = []
+    for proxy, ok in zip(proxies, results):
+        if ok and within_latency(proxy, max_latency_ms):
+            valid.append(proxy)
+    valid.sort(key=lambda p: p.get('ttfb_ms', 0))
+    return valid
+
+def write_json_atomic(path: str, data):
+    """先写临时文件再替换，写入中途退出或其他进程同时读取时不会看到不完整的文件"""
+    tmp_file = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, path)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+class DebouncedSave:
+    """延迟合并写入文件
+    频繁的状态变化（如每次请求的成功/失败）只调用 mark_dirty，save_interval 秒内合并写入一次，
+    进程退出时写入未保存的变化；子类需要提供 save_interval、_lock 和 _save_now()
+    """
+    
+    _dirty = False
+    _save_timer = None
+    
+    def mark_dirty(self):
+        """标记有变化，在 save_interval 秒内合并写入一次"""
+        with self._lock:
+            self._dirty = True
+            if self._save_timer is not None and self._save_timer.is_alive():
+                return
+            self._save_timer = threading.Timer(self.save_interval, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+    
+    def flush(self):
+        """有未保存的变化时立即写入文件"""
+        if self._dirty:
+            self._save_now()
+
+class ProxyManager(DebouncedSave):
+    """代理池
+    进程内所有模块共享同一个实例（见下方全局 proxy_manager），
+    所有读写都在同一把可重入锁内完成，多个工作线程并发使用时状态保持一致
+    """
+    
+    def __init__(self, config_file: str = "proxy_list.json", save_interval: float = PROXY_SAVE_INTERVAL,
+                 breakers: Optional[CircuitBreakerRegistry] = None):
+        """
+        Args:
+            config_file: 代理列表文件
+            save_interval: 请求结果导致的状态变化最多延迟多久写入文件（秒）
+            breakers: 代理熔断器，默认使用全局 proxy_breakers
+        """
         self.config_file = config_file
+        self.save_interval = save_interval
+        self.breakers = breakers or proxy_breakers
+        # 熔断中的代理 (预计恢复时间, key)，到期后恢复其权重
+        self._cooldowns = []
         self.proxy_list = self.load_proxy_list()
         self.current_proxy = None
+        self._lock = threading.RLock()
+        self._rebuild_index()
+        atexit.register(self.flush)
+    
+    def _rebuild_index(self):
+        """重建 (ip, port) 索引和选择权重表（加载、删除代理或更换权重参考时间时调用）"""
+        self._positions = {proxy_key(p): i for i, p in enumerate(self.proxy_list)}
+        self._cooldowns = []
+        # 使用时长衰减的参考时间，所有权重以同一时间计算（见 proxy_selector）
+        self._reference = time.time()
+        self._weights = WeightedIndex([self._weight(p) for p in self.proxy_list])
+    
+    def _rebase_if_needed(self):
+        """参考时间过旧时新代理的权重会越来越大，超过若干个半衰期后以当前时间重算所有权重"""
+        if PROXY_AGE_HALF_LIFE > 0 and time.time() - self._reference > 16 * PROXY_AGE_HALF_LIFE:
+            self._rebuild_index()
+    
+    def find_proxy(self, proxy: Dict) -> Optional[int]:
+        """按 (ip, port) 查找代理在列表中的位置"""
+        return self._positions.get(proxy_key(proxy))
+    
+    def _weight(self, proxy: Dict) -> float:
+        """代理的选择权重；熔断中的代理为 0，并登记恢复时间"""
+        key = proxy_key(proxy)
+        if not self.breakers.available(key):
+            heapq.heappush(self._cooldowns, (self.breakers.retry_at(key), key))
+            return 0.0
+        return proxy_score(proxy, reference=self._reference)
+    
+    def _refresh_weight(self, index: int):
+        """代理信息变化后更新其权重"""
+        self._weights.update(index, self._weight(self.proxy_list[index]))
+    
+    def _restore_cooled(self):
+        """熔断冷却结束的代理恢复权重（进入半开状态，可以被选中做探测）"""
+        now = time.time()
+        while self._cooldowns and self._cooldowns[0][0] <= now:
+            _, key = heapq.heappop(self._cooldowns)
+            index = self._positions.get(key)
+            if index is not None:
+                self._refresh_weight(index)
     
     def load_proxy_list(self) -> List[Dict]:
-        """加载代理列表"""
+        """加载代理列表（旧版文件中没有加入时间的代理，按文件最后写入时间计算）"""
         if os.path.exists(self.config_file):
             try:
                 with open(self.config_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                    proxy_list = json.load(f)
+                saved_at = os.path.getmtime(self.config_file)
+                for proxy in proxy_list:
+                    proxy.setdefault('added_at', saved_at)
+                return proxy_list
             except Exception as e:
                 print(f"加载代理配置文件失败: {e}")
                 return []
         return []
     
     def save_proxy_list(self):
-        """保存代理列表"""
-        try:
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(self.proxy_list, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"保存代理配置文件失败: {e}")
+        """保存代理列表（先写临时文件再替换，写入中途退出不会损坏原文件）"""
+        with self._lock:
+            self._dirty = False
+            try:
+                write_json_atomic(self.config_file, self.proxy_list)
+            except Exception as e:
+                self._dirty = True
+                print(f"保存代理配置文件失败: {e}")
+    
+    _save_now = save_proxy_list
     
     def add_proxy(self, ip: str, port: int, username: str = "", password: str = "", 
-                  proxy_type: str = "http", enabled: bool = True):
-        """添加代理"""
+                  proxy_type: str = "http", enabled: bool = True, **fields):
+        """添加代理（fields 为附加信息，如测得的延迟）"""
         proxy = {
             "ip": ip,
             "port": port,
@@ -46,109 +229,113 @@ class ProxyManager:
             "type": proxy_type,
             "enabled": enabled,
             "fail_count": 0,
-            "last_used": None
+            "last_used": None,
+            "added_at": time.time(),
+            **fields
         }
-        self.proxy_list.append(proxy)
-        self.save_proxy_list()
+        with self._lock:
+            index = self.find_proxy(proxy)
+            if index is None:
+                self._positions[proxy_key(proxy)] = len(self.proxy_list)
+                self.proxy_list.append(proxy)
+                self._weights.append(self._weight(proxy))
+            else:
+                # 已存在的代理重新加入时刷新其信息
+                self.proxy_list[index] = proxy
+                self._refresh_weight(index)
+            self.save_proxy_list()
     
     def remove_proxy(self, index: int):
         """删除代理"""
-        if 0 <= index < len(self.proxy_list):
-            del self.proxy_list[index]
-            self.save_proxy_list()
+        with self._lock:
+            if 0 <= index < len(self.proxy_list):
+                del self.proxy_list[index]
+                self._rebuild_index()
+                self.save_proxy_list()
     
     def get_random_proxy(self) -> Optional[Dict]:
-        """获取随机可用代理"""
-        available_proxies = [p for p in self.proxy_list if p.get('enabled', True)]
-        if not available_proxies:
-            return None
-        
-        # 只使用非本地代理（从API获取的代理）
-        api_proxies = [p for p in available_proxies if not p['ip'].startswith('127.0.0.1') and not p['ip'].startswith('localhost')]
-        
-        # 如果没有API代理，返回None
-        if not api_proxies:
-            print("警告: 没有可用的API代理，尝试更新代理...")
-            return None
-        
-        # 按失败次数排序，优先使用失败次数少的代理
-        api_proxies.sort(key=lambda x: x.get('fail_count', 0))
+        """按权重随机获取可用代理
         
-        # 从前50%的代理中随机选择
-        select_count = max(1, len(api_proxies) // 2)
-        selected_proxy = random.choice(api_proxies[:select_count])
-        
-        self.current_proxy = selected_proxy
-        return selected_proxy
+        权重综合近期成功率、延迟和使用时长（见 proxy_selector），
+        禁用代理、本地代理、租约即将过期和熔断中的代理权重为 0，不会被选中；
+        半开状态的代理被选中时作为探测请求，结果回报前不再分配给其他请求
+        """
+        with self._lock:
+            self._rebase_if_needed()
+            self._restore_cooled()
+            while True:
+                index = self._weights.sample()
+                
+                # 如果没有API代理，返回None
+                if index is None:
+                    print("警告: 没有可用的API代理，尝试更新代理...")
+                    return None
+                
+                selected_proxy = self.proxy_list[index]
+                # 权重只在代理信息变化时更新，抽到租约已到期的代理时清零其权重后重新抽取
+                if is_lease_expired(selected_proxy, PROXY_LEASE_MARGIN):
+                    self._refresh_weight(index)
+                    continue
+                allowed = self.breakers.allow_request(proxy_key(selected_proxy))
+                # 半开状态占用探测名额后权重变为 0
+                self._refresh_weight(index)
+                if allowed:
+                    break
+            
+            # 仅用于状态展示，请求路径使用各自选中的代理
+            self.current_proxy = selected_proxy
+            return selected_proxy
     
     def get_proxy_config(self) -> Optional[Dict]:
         """获取当前代理配置"""
-        proxy = self.get_random_proxy()
-        if not proxy:
-            return None
-        
-        # 构建代理URL
-        if proxy.get('username') and proxy.get('password'):
-            proxy_url = f"{proxy['type']}://{proxy['username']}:{proxy['password']}@{proxy['ip']}:{proxy['port']}"
-        else:
-            proxy_url = f"{proxy['type']}://{proxy['ip']}:{proxy['port']}"
-        
-        return {
-            "http": proxy_url,
-            "https": proxy_url
-        }
+        return build_proxies(self.get_random_proxy())
     
     def mark_proxy_failed(self, proxy: Dict):
         """标记代理失败"""
-        for p in self.proxy_list:
-            if p['ip'] == proxy['ip'] and p['port'] == proxy['port']:
-                p['fail_count'] = p.get('fail_count', 0) + 1
-                # 如果失败次数过多，禁用代理
-                if p['fail_count'] >= 5:
-                    p['enabled'] = False
-                break
-        self.save_proxy_list()
+        with self._lock:
+            index = self.find_proxy(proxy)
+            if index is None:
+                return
+            p = self.proxy_list[index]
+            p['fail_count'] = p.get('fail_count', 0) + 1
+            update_success_rate(p, False)
+            # 失败率过高时熔断，冷却后探测恢复（不再永久禁用）
+            self.breakers.record(proxy_key(p), False)
+            self._refresh_weight(index)
+            self.mark_dirty()
     
     def mark_proxy_success(self, proxy: Dict):
         """标记代理成功"""
-        for p in self.proxy_list:
-            if p['ip'] == proxy['ip'] and p['port'] == proxy['port']:
-                p['fail_count'] = 0
-                p['last_used'] = None
-                break
-        self.save_proxy_list()
+        with self._lock:
+            index = self.find_proxy(proxy)
+            if index is None:
+                return
+            p = self.proxy_list[index]
+            p['fail_count'] = 0
+            p['last_used'] = None
+            update_success_rate(p, True)
+            self.breakers.record(proxy_key(p), True)
+            self._refresh_weight(index)
+            self.mark_dirty()
     
     def list_proxies(self):
         """列出所有代理"""
         print("代理列表:")
-        for i, proxy in enumerate(self.proxy_list):
+        for i, proxy in enumerate(self.snapshot()):
             status = "✅" if proxy.get('enabled', True) else "❌"
             print(f"{i}: {status} {proxy['type']}://{proxy['ip']}:{proxy['port']} "
-                  f"(失败: {proxy.get('fail_count', 0)})")
+                  f"(失败: {proxy.get('fail_count', 0)}, 熔断: {self.breakers.state(proxy_key(proxy))})")
+    
+    def snapshot(self) -> List[Dict]:
+        """返回代理列表的副本（供展示或遍历，避免与并发修改冲突）"""
+        with self._lock:
+            return [dict(p) for p in self.proxy_list]
     
     def test_proxy(self, proxy: Dict) -> bool:
-        """测试代理是否可用"""
-        import requests
-        
-        proxy_config = {
-            "http": f"{proxy['type']}://{proxy['ip']}:{proxy['port']}",
-            "https": f"{proxy['type']}://{proxy['ip']}:{proxy['port']}"
-        }
-        
-        if proxy.get('username') and proxy.get('password'):
-            proxy_config = {
-                "http": f"{proxy['type']}://{proxy['username']}:{proxy['password']}@{proxy['ip']}:{proxy['port']}",
-                "https": f"{proxy['type']}://{proxy['username']}:{proxy['password']}@{proxy['ip']}:{proxy['port']}"
-            }
-        
-        try:
-            response = requests.get("http://httpbin.org/ip", proxies=proxy_config, timeout=10)
-            if response.status_code == 200:
-                print(f"代理测试成功: {proxy['ip']}:{proxy['port']}")
-                return True
-        except Exception as e:
-            print(f"代理测试失败: {proxy['ip']}:{proxy['port']} - {e}")
-        
+        """测试代理是否可用且延迟达标，测得的延迟记录在代理信息上"""
+        if measure_proxy(proxy) and within_latency(proxy):
+            print(f"代理测试成功: {proxy['ip']}:{proxy['port']} (连接 {proxy.get('connect_ms')}ms, 首字节 {proxy.get('ttfb_ms')}ms)")
+            return True
         return False
 
 # 全局代理管理器实例
@@ -161,8 +348,12 @@ def get_proxy_config():
 def make_request_with_proxy(method, url, **kwargs):
     """使用代理发送请求（增强版）"""
     import requests
+    from session_pool import session_pool
+    from rate_limiter import rate_limiter
     
-    proxy_config = get_proxy_config()
+    # 每次请求使用自己选中的代理，不依赖共享的 current_proxy（并发时会被其他线程改写）
+    proxy = proxy_manager.get_random_proxy()
+    proxy_config = build_proxies(proxy)
     max_retries = 3
     retry_count = 0
     
@@ -174,38 +365,35 @@ def make_request_with_proxy(method, url, **kwargs):
             else:
                 print(f"直接发送请求: {method} {url}")
             
-            if method.upper() == 'GET':
-                response = requests.get(url, **kwargs)
-            elif method.upper() == 'POST':
-                response = requests.post(url, **kwargs)
-            else:
+            if method.upper() not in ('GET', 'POST'):
                 raise ValueError(f"不支持的请求方法: {method}")
             
+            rate_limiter.wait(url, proxy_config['http'] if proxy_config else None)
+            response = session_pool.request(method.upper(), url, **kwargs)
+            
             # 请求成功，标记代理成功
-            if proxy_config and proxy_manager.current_proxy:
-                proxy_manager.mark_proxy_success(proxy_manager.current_proxy)
+            if proxy:
+                proxy_manager.mark_proxy_success(proxy)
             
             return response
             
         except requests.exceptions.ProxyError as e:
             print(f"代理连接失败: {e}")
             # 标记代理失败
-            if proxy_manager.current_proxy:
-                proxy_manager.mark_proxy_failed(proxy_manager.current_proxy)
+            if proxy:
+                proxy_manager.mark_proxy_failed(proxy)
             
             retry_count += 1
             if retry_count < max_retries:
                 print(f"尝试使用其他代理 (重试 {retry_count}/{max_retries})")
                 # 获取新的代理
-                proxy_config = get_proxy_config()
+                proxy = proxy_manager.get_random_proxy()
+                proxy_config = build_proxies(proxy)
                 continue
             else:
                 print("所有代理都失败，尝试直接连接...")
                 kwargs.pop('proxies', None)
-                if method.upper() == 'GET':
-                    return requests.get(url, **kwargs)
-                elif method.upper() == 'POST':
-                    return requests.post(url, **kwargs)
+                return session_pool.request(method.upper(), url, **kwargs)
                 
         except Exception as e:
             print(f"请求失败: {e}")
@@ -213,12 +401,12 @@ def make_request_with_proxy(method, url, **kwargs):
             if retry_count == 0 and ("连接" in str(e) or "timeout" in str(e).lower() or "refused" in str(e).lower()):
                 print("检测到网络错误，尝试更新代理...")
                 try:
-                    # 尝试从API更新代理
-                    from proxy_api import ProxyAPI
-                    api = ProxyAPI()
-                    if api.auto_update_proxy():
+                    # 尝试从API更新代理（新代理加入共享的代理池）
+                    from proxy_api import proxy_api
+                    if proxy_api.auto_update_proxy():
                         print("代理更新成功，重试请求...")
-                        proxy_config = get_proxy_config()
+                        proxy = proxy_manager.get_random_proxy()
+                        proxy_config = build_proxies(proxy)
                         retry_count += 1
                         continue
                 except Exception as update_error:
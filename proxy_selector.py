@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+代理选择
+按代理的近期成功率、延迟和使用时长计算权重，用树状数组（Fenwick tree）维护，
+权重变化时增量更新，按权重随机抽取一个代理，两者都是 O(log n)
+
+使用时长的衰减 0.5^((now - added_at)/half_life) 可以拆成所有代理共有的 0.5^(now/half_life)
+和每个代理固定的部分，共有部分不影响按权重抽样的结果，因此缓存的权重以一个固定的参考时间计算，
+不会因为代理长时间没有被使用而停止衰减
+"""
+
+import os
+import random
+import time
+from typing import Dict, List, Optional
+
+# 成功率的指数移动平均系数（越大越看重最近的结果）
+SUCCESS_EWMA_ALPHA = 0.2
+# 使用时长的半衰期（秒）：代理加入超过该时间后权重减半
+PROXY_AGE_HALF_LIFE = float(os.getenv("PROXY_AGE_HALF_LIFE", "1800"))
+# 本地代理不参与选择
+LOCAL_HOSTS = ("127.0.0.1", "localhost")
+# 租约剩余时间少于该值（秒）的代理视为即将过期，不再分配
+PROXY_LEASE_MARGIN = float(os.getenv("PROXY_LEASE_MARGIN", "60"))
+
+def lease_remaining(proxy: Dict, now: Optional[float] = None) -> float:
+    """代理租约剩余秒数；没有租约信息的代理（手动添加的）视为不过期"""
+    if not proxy.get('lease_seconds') or not proxy.get('acquired_at'):
+        return float('inf')
+    now = time.time() if now is None else now
+    return proxy['acquired_at'] + proxy['lease_seconds'] - now
+
+def is_lease_expired(proxy: Dict, margin: float = 0, now: Optional[float] = None) -> bool:
+    """代理租约是否已过期（或剩余时间不足 margin 秒）"""
+    return lease_remaining(proxy, now) <= margin
+
+def update_success_rate(proxy: Dict, success: bool):
+    """用本次请求结果更新代理的近期成功率"""
+    rate = proxy.get('success_rate', 1.0)
+    proxy['success_rate'] = (1 - SUCCESS_EWMA_ALPHA) * rate + SUCCESS_EWMA_ALPHA * (1.0 if success else 0.0)
+
+def proxy_score(proxy: Dict, now: Optional[float] = None, reference: Optional[float] = None) -> float:
+    """计算代理的选择权重，禁用、本地或租约即将过期的代理为 0
+    
+    Args:
+        now: 当前时间，用于判断租约
+        reference: 计算使用时长衰减的参考时间，默认为 now；同一个权重表中的代理必须使用相同的参考时间
+    """
+    if not proxy.get('enabled', True) or proxy['ip'] in LOCAL_HOSTS:
+        return 0.0
+    now = time.time() if now is None else now
+    if is_lease_expired(proxy, PROXY_LEASE_MARGIN, now):
+        return 0.0
+    success = max(proxy.get('success_rate', 1.0), 0.01)
+    # 没有测过延迟的代理按 1 秒计算
+    latency = 1.0 / (1.0 + proxy.get('ttfb_ms', 1000) / 1000.0)
+    reference = now if reference is None else reference
+    # 参考时间之后加入的代理 age 为负，权重相应大于 1
+    age = reference - proxy.get('added_at', reference)
+    freshness = 0.5 ** (age / PROXY_AGE_HALF_LIFE) if PROXY_AGE_HALF_LIFE > 0 else 1.0
+    return success * success * latency * freshness
+
+class WeightedIndex:
+    """树状数组维护的权重表，支持 O(log n) 的更新和按权重抽样"""
+
+    def __init__(self, weights: Optional[List[float]] = None):
+        self._weights: List[float] = []
+        self._tree: List[float] = [0.0]
+        for weight in weights or []:
+            self.append(weight)
+
+    def __len__(self) -> int:
+        return len(self._weights)
+
+    def append(self, weight: float) -> int:
+        """追加一个位置，返回其下标"""
+        index = len(self._weights)
+        self._weights.append(0.0)
+        # 新节点覆盖区间 (i - lowbit(i), i]，其中除自身外的部分取自已有前缀和
+        i = index + 1
+        self._tree.append(self._prefix(i - 1) - self._prefix(i - (i & -i)))
+        self.update(index, weight)
+        return index
+
+    def update(self, index: int, weight: float):
+        """设置某个位置的权重"""
+        weight = max(weight, 0.0)
+        delta = weight - self._weights[index]
+        if not delta:
+            return
+        self._weights[index] = weight
+        i = index + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, i: int) -> float:
+        total = 0.0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def total(self) -> float:
+        return self._prefix(len(self._weights))
+
+    def sample(self) -> Optional[int]:
+        """按权重随机抽取一个下标，所有权重为 0 时返回 None"""
+        total = self.total()
+        if total <= 0:
+            return None
+        target = random.random() * total
+        pos = 0
+        step = 1 << (len(self._weights).bit_length())
+        while step:
+            nxt = pos + step
+            if nxt < len(self._tree) and self._tree[nxt] <= target:
+                pos = nxt
+                target -= self._tree[nxt]
+            step >>= 1
+        # 浮点误差可能落到末尾权重为 0 的位置，向前找最近的有效位置
+        index = min(pos, len(self._weights) - 1)
+        while index > 0 and self._weights[index] <= 0:
+            index -= 1
+        return index if self._weights[index] > 0 else None
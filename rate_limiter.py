@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+请求节流
+按目标主机和代理分别使用令牌桶限速，并叠加随机抖动。
+只在需要等待的调用方上休眠（gevent 下为协作式休眠，asyncio 下使用 wait_async），
+其他账号的请求不受影响。
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+class TokenBucket:
+    """令牌桶：平均每秒 rate 个请求，允许 capacity 个突发"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """预占一个令牌，返回调用方需要等待的秒数
+
+        令牌可以透支为负数，后来的调用方据此排在更靠后的时间点，
+        锁只在计算时持有，等待在锁外进行。
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+class RateLimiter:
+    def __init__(self, host_limits: Optional[Dict[str, Tuple[float, float]]] = None,
+                 proxy_limit: Optional[Tuple[float, float]] = None, jitter: float = 0.0):
+        """
+        Args:
+            host_limits: 主机名 -> (每秒请求数, 突发数)，未配置的主机不限速
+            proxy_limit: 每个代理的 (每秒请求数, 突发数)，None 表示不按代理限速
+            jitter: 每次请求额外附加的最大随机延迟（秒）
+        """
+        self.host_limits = host_limits or {}
+        self.proxy_limit = proxy_limit
+        self.jitter = jitter
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, key: str, limit: Tuple[float, float]) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(*limit)
+            return bucket
+
+    def reserve(self, url: str, proxy_url: Optional[str] = None) -> float:
+        """为一次请求预占主机和代理的令牌，返回需要等待的秒数"""
+        wait = 0.0
+        host = urlparse(url).hostname or ""
+        if host in self.host_limits:
+            wait = self._bucket(f"host:{host}", self.host_limits[host]).reserve()
+        if proxy_url and self.proxy_limit:
+            wait = max(wait, self._bucket(f"proxy:{proxy_url}", self.proxy_limit).reserve())
+        if self.jitter:
+            wait += random.uniform(0, self.jitter)
+        return wait
+
+    def wait(self, url: str, proxy_url: Optional[str] = None):
+        """阻塞等待直到允许发送请求"""
+        delay = self.reserve(url, proxy_url)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self, url: str, proxy_url: Optional[str] = None):
+        """协程版本，等待期间事件循环可处理其他账号"""
+        delay = self.reserve(url, proxy_url)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+def _limit_from_env(rate_name: str, burst_name: str, rate: str, burst: str) -> Tuple[float, float]:
+    return (float(os.getenv(rate_name, rate)), float(os.getenv(burst_name, burst)))
+
+# 全局限速器：业务接口和代理商API分别配置
+rate_limiter = RateLimiter(
+    host_limits={
+        "qy.doufp.com": _limit_from_env("UPSTREAM_RATE_LIMIT", "UPSTREAM_BURST", "5", "5"),
+        "api.xiequ.cn": _limit_from_env("PROXY_API_RATE_LIMIT", "PROXY_API_BURST", "1", "1"),
+    },
+    proxy_limit=_limit_from_env("PER_PROXY_RATE_LIMIT", "PER_PROXY_BURST", "1", "2"),
+    jitter=float(os.getenv("PACING_JITTER", "0.3"))
+)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+重试策略
+所有重试路径共用：全进程的重试预算（一段时间内重试次数不超过首次请求的一定比例）、
+全抖动指数退避、单个请求的最大尝试次数。上游故障时重试量有上限，不会形成重试风暴
+"""
+
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+class RetryBudget:
+    def __init__(self, ratio: float = 0.2, min_retries: int = 10, window: float = 60):
+        """
+        Args:
+            ratio: 窗口内允许的重试次数占首次请求次数的比例
+            min_retries: 窗口内至少允许的重试次数（请求量很小时也能重试）
+            window: 统计窗口（秒）
+        """
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window = window
+        self._requests = deque()
+        self._retries = deque()
+        self._lock = threading.Lock()
+
+    def _trim(self, now: float):
+        for timestamps in (self._requests, self._retries):
+            while timestamps and timestamps[0] <= now - self.window:
+                timestamps.popleft()
+
+    def record_request(self):
+        """记录一次首次请求"""
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            self._requests.append(now)
+
+    def try_retry(self) -> bool:
+        """申请一次重试，预算用完时返回 False"""
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            if len(self._retries) >= self.min_retries + self.ratio * len(self._requests):
+                return False
+            self._retries.append(now)
+            return True
+
+class RetryPolicy:
+    def __init__(self, budget: RetryBudget, base_delay: float = 1, max_delay: float = 30, max_attempts: int = 5):
+        """
+        Args:
+            budget: 重试预算
+            base_delay: 退避基数（秒）
+            max_delay: 单次退避上限（秒）
+            max_attempts: 单个请求最多尝试次数（含首次）
+        """
+        self.budget = budget
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+
+    def record_request(self):
+        """开始一个新请求（首次尝试）时调用"""
+        self.budget.record_request()
+
+    def allow_retry(self, attempts: int, max_attempts: Optional[int] = None) -> bool:
+        """已尝试 attempts 次后是否可以再试一次（未超过最大次数且预算未用完）
+        
+        Args:
+            max_attempts: 本次请求的最大尝试次数，默认使用 self.max_attempts
+        """
+        if attempts >= (self.max_attempts if max_attempts is None else max_attempts):
+            return False
+        return self.allow_fallback()
+
+    def allow_fallback(self) -> bool:
+        """代理失败后的兜底请求（如改为直接连接）同样是额外的上游请求，也从重试预算中扣除"""
+        if not self.budget.try_retry():
+            print("重试预算已用完，放弃重试")
+            return False
+        return True
+
+    def backoff(self, attempts: int) -> float:
+        """全抖动指数退避：在 [0, min(max_delay, base_delay * 2^(attempts-1))] 中随机取值"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** max(attempts - 1, 0)))
+
+# 全局重试策略
+retry_policy = RetryPolicy(
+    RetryBudget(
+        ratio=float(os.getenv("RETRY_BUDGET_RATIO", "0.2")),
+        min_retries=int(os.getenv("RETRY_BUDGET_MIN", "10")),
+        window=float(os.getenv("RETRY_BUDGET_WINDOW", "60"))
+    ),
+    base_delay=float(os.getenv("RETRY_BASE_DELAY", "1")),
+    max_delay=float(os.getenv("RETRY_MAX_DELAY", "30")),
+    max_attempts=int(os.getenv("RETRY_MAX_ATTEMPTS", "5"))
+)
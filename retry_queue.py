@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+延迟重试队列
+任务按下次执行时间放入堆中，由一个调度线程在到期时交给工作线程池执行，
+等待退避的任务不占用工作线程，工作线程可以继续处理其他任务
+"""
+
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+class DelayedRetryQueue:
+    def __init__(self, max_workers: int = 5, name: str = "retry-queue"):
+        """
+        Args:
+            max_workers: 执行任务的工作线程数
+            name: 线程名前缀
+        """
+        self.max_workers = max_workers
+        self.name = name
+        # (执行时间, 序号, 函数, 参数)
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._executor = None
+        self._thread = None
+        self._pid = None
+
+    def _ensure_started(self):
+        """按需启动调度线程和线程池；gunicorn fork 后在子进程中重新创建"""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+        self._thread = threading.Thread(target=self._dispatch, name=f"{self.name}-dispatcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn: Callable, *args, delay: float = 0.0):
+        """delay 秒后在工作线程中执行 fn(*args)"""
+        with self._cond:
+            self._ensure_started()
+            heapq.heappush(self._heap, (time.monotonic() + max(delay, 0.0), next(self._seq), fn, args))
+            self._cond.notify()
+
+    def pending(self) -> int:
+        """等待执行的任务数"""
+        with self._cond:
+            return len(self._heap)
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                wait_time = self._heap[0][0] - time.monotonic()
+                if wait_time > 0:
+                    # 等到最早的任务到期，期间有新任务加入时重新检查
+                    self._cond.wait(wait_time)
+                    continue
+                _, _, fn, args = heapq.heappop(self._heap)
+                executor = self._executor
+            executor.submit(fn, *args)
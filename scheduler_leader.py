@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+定时任务主进程选举
+gunicorn 多个 worker 进程通过文件锁竞争，只有持有锁的进程启动调度器。
+持锁进程退出后操作系统自动释放锁，其他进程在下一次重试时接管。
+"""
+
+import os
+import threading
+from typing import Callable, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+class SchedulerLeader:
+    def __init__(self, lock_file: str, on_elected: Callable[[], None], retry_interval: float = 30):
+        """
+        Args:
+            lock_file: 选举使用的锁文件
+            on_elected: 当选后调用（例如启动调度器）
+            retry_interval: 未当选时重试的间隔（秒）
+        """
+        self.lock_file = lock_file
+        self.on_elected = on_elected
+        self.retry_interval = retry_interval
+        self.is_leader = False
+        self._handle = None
+        self._stop = threading.Event()
+
+    def try_acquire(self) -> bool:
+        """非阻塞地尝试获取锁，成功后一直持有直到进程退出"""
+        if self.is_leader:
+            return True
+        handle = open(self.lock_file, "a+")
+        try:
+            if fcntl:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            handle.close()
+            return False
+        # 记录当前主进程，便于排查
+        handle.seek(0)
+        handle.truncate()
+        handle.write(str(os.getpid()))
+        handle.flush()
+        self._handle = handle
+        self.is_leader = True
+        return True
+
+    def _elect(self) -> bool:
+        if not self.try_acquire():
+            return False
+        print(f"进程 {os.getpid()} 成为定时任务主进程")
+        self.on_elected()
+        return True
+
+    def _standby(self):
+        while not self._stop.wait(self.retry_interval):
+            if self._elect():
+                return
+
+    def start(self):
+        """参与选举；未当选时在后台定期重试，主进程退出后自动接管"""
+        if not self._elect():
+            threading.Thread(target=self._standby, name="scheduler-leader", daemon=True).start()
+
+    def stop(self):
+        """停止重试并释放锁"""
+        self._stop.set()
+        if self._handle:
+            self._handle.close()
+            self._handle = None
+        self.is_leader = False
+
+    @property
+    def holder_pid(self) -> Optional[int]:
+        """当前持锁进程的PID（读取锁文件）"""
+        try:
+            with open(self.lock_file, "r") as f:
+                return int(f.read().strip() or 0) or None
+        except (OSError, ValueError):
+            return None
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTTP会话池
+按 (账号, 代理地址) 复用 requests.Session，同一账号的登录、签到、查余额、提现
+共用一条保持连接，TCP/TLS 和代理 CONNECT 握手只需一次；
+不指定账号的请求共用的会话不保存 Cookie，避免一个账号的登录状态泄漏到其他请求
+"""
+
+import http.cookiejar
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import requests
+
+class SessionPool:
+    def __init__(self, max_size: int = 500, idle_timeout: float = 300):
+        """
+        Args:
+            max_size: 最多保留的会话数量，超出时淘汰最久未使用的会话
+            idle_timeout: 会话空闲超过该秒数后被淘汰
+        """
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        # key -> (session, 最后使用时间)，按使用时间从旧到新排列
+        self._sessions: "OrderedDict[Tuple[str, str], Tuple[requests.Session, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(account: Optional[str], proxies: Optional[Dict]) -> Tuple[str, str]:
+        """会话键：账号 + 代理地址"""
+        proxy_url = ""
+        if proxies:
+            proxy_url = proxies.get('https') or proxies.get('http') or ""
+        return (account or "", proxy_url)
+
+    def _evict_idle(self, now: float):
+        """淘汰空闲和超量的会话（调用方需持有锁）"""
+        while self._sessions:
+            key, (session, last_used) = next(iter(self._sessions.items()))
+            if now - last_used < self.idle_timeout and len(self._sessions) <= self.max_size:
+                break
+            del self._sessions[key]
+            session.close()
+
+    @staticmethod
+    def _new_session(account: Optional[str]) -> requests.Session:
+        session = requests.Session()
+        if not account:
+            # 匿名会话由多个请求共用，拒绝保存任何 Cookie
+            session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+        return session
+
+    def get_session(self, account: Optional[str] = None, proxies: Optional[Dict] = None) -> requests.Session:
+        """获取（或创建）账号和代理对应的会话"""
+        key = self.make_key(account, proxies)
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.pop(key, None)
+            session = entry[0] if entry else self._new_session(account)
+            self._sessions[key] = (session, now)
+            self._evict_idle(now)
+        return session
+
+    def evict(self, account: Optional[str], proxies: Optional[Dict] = None):
+        """移除会话；不指定代理时移除该账号的所有会话"""
+        with self._lock:
+            if proxies is not None:
+                keys = [self.make_key(account, proxies)]
+            else:
+                keys = [k for k in self._sessions if k[0] == (account or "")]
+            for key in keys:
+                entry = self._sessions.pop(key, None)
+                if entry:
+                    entry[0].close()
+
+    def request(self, method: str, url: str, account: Optional[str] = None, **kwargs) -> requests.Response:
+        """通过池中会话发送请求，连接类异常时丢弃该会话"""
+        proxies = kwargs.get('proxies')
+        session = self.get_session(account, proxies)
+        try:
+            return session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            self.evict(account, proxies or {})
+            raise
+
+    def close_all(self):
+        """关闭所有会话"""
+        with self._lock:
+            for session, _ in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+# 全局会话池实例
+session_pool = SessionPool(
+    max_size=int(os.getenv("SESSION_POOL_SIZE", "500")),
+    idle_timeout=float(os.getenv("SESSION_IDLE_TIMEOUT", "300"))
+)
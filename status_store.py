@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+账号状态存储
+使用 SQLite（WAL 模式）保存每个账号的签到/余额/提现状态和定时任务运行状态，
+按行更新，多个线程和 gunicorn 进程可以同时读写
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+STATUS_FIELDS = ("date", "signed", "sign_msg", "balance", "withdraw_status")
+
+class SQLiteStore:
+    """SQLite 存储基类"""
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+        self._init_db()
+
+    def _init_db(self):
+        pass
+
+    @contextmanager
+    def _connect(self):
+        """每次操作使用独立连接（gunicorn fork 后也安全），退出时提交事务"""
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+class StatusStore(SQLiteStore):
+    def __init__(self, db_file: str = "status.db", json_file: Optional[str] = None):
+        """
+        Args:
+            db_file: SQLite 数据库文件
+            json_file: 旧版 status.json，首次启动时导入
+        """
+        super().__init__(db_file)
+        if json_file:
+            self.migrate_from_json(json_file)
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS account_status (
+                    account TEXT PRIMARY KEY,
+                    date TEXT,
+                    signed INTEGER NOT NULL DEFAULT 0,
+                    sign_msg TEXT,
+                    balance REAL,
+                    withdraw_status TEXT,
+                    updated_at TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_account_status_date ON account_status(date)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    @staticmethod
+    def _row_to_entry(row: sqlite3.Row) -> Dict:
+        entry = {field: row[field] for field in STATUS_FIELDS}
+        entry['signed'] = bool(entry['signed'])
+        return entry
+
+    def get(self, account: str) -> Dict:
+        """获取单个账号的状态，不存在时返回空字典"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM account_status WHERE account = ?", (account,)).fetchone()
+        return self._row_to_entry(row) if row else {}
+
+    def get_all(self) -> Dict[str, Dict]:
+        """获取所有账号的状态"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM account_status").fetchall()
+        return {row['account']: self._row_to_entry(row) for row in rows}
+
+    def get_by_date(self, date: str) -> Dict[str, Dict]:
+        """获取指定日期处理过的账号状态"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM account_status WHERE date = ?", (date,)).fetchall()
+        return {row['account']: self._row_to_entry(row) for row in rows}
+
+    def upsert(self, account: str, entry: Dict):
+        """写入或更新单个账号的状态"""
+        self.upsert_many({account: entry})
+
+    def upsert_many(self, entries: Dict[str, Dict]):
+        """在一个事务中写入多个账号的状态"""
+        now = time.strftime('%Y-%m-%d %H:%M:%S')
+        rows = [
+            (account, entry.get('date'), int(bool(entry.get('signed', False))), entry.get('sign_msg', ''),
+             entry.get('balance'), entry.get('withdraw_status', ''), now)
+            for account, entry in entries.items()
+        ]
+        with self._connect() as conn:
+            conn.executemany("""
+                INSERT INTO account_status (account, date, signed, sign_msg, balance, withdraw_status, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(account) DO UPDATE SET
+                    date = excluded.date,
+                    signed = excluded.signed,
+                    sign_msg = excluded.sign_msg,
+                    balance = excluded.balance,
+                    withdraw_status = excluded.withdraw_status,
+                    updated_at = excluded.updated_at
+            """, rows)
+
+    def delete(self, accounts: Iterable[str]):
+        """删除账号状态"""
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM account_status WHERE account = ?", [(a,) for a in accounts])
+
+    def migrate_from_json(self, json_file: str) -> int:
+        """把旧版 status.json 导入数据库（只执行一次），返回导入的账号数"""
+        with self._connect() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+                return 0
+        entries = {}
+        if os.path.exists(json_file):
+            try:
+                with open(json_file, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                # 只导入账号状态记录，忽略旧版全局字段
+                entries = {k: v for k, v in data.items() if isinstance(v, dict)}
+            except Exception as e:
+                print(f"读取旧状态文件失败: {e}")
+                return 0
+        if entries:
+            self.upsert_many(entries)
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)",
+                         (time.strftime('%Y-%m-%d %H:%M:%S'),))
+        if entries:
+            print(f"已从 {json_file} 导入 {len(entries)} 个账号状态")
+        return len(entries)
+
+TASK_COUNTERS = ("total_accounts", "success_count", "error_count")
+
+class TaskStateStore(SQLiteStore):
+    """定时任务运行状态（运行标记、进度计数、每个账号的结果），所有进程共享"""
+
+    def __init__(self, db_file: str = "status.db", stale_after: float = 1800):
+        """
+        Args:
+            db_file: SQLite 数据库文件
+            stale_after: 运行中的任务超过该秒数没有心跳，视为所在进程已退出，允许重新启动
+        """
+        self.stale_after = stale_after
+        super().__init__(db_file)
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS task_state (
+                    task TEXT PRIMARY KEY,
+                    run_id TEXT,
+                    is_running INTEGER NOT NULL DEFAULT 0,
+                    last_run TEXT,
+                    finished_at TEXT,
+                    heartbeat REAL,
+                    total_accounts INTEGER NOT NULL DEFAULT 0,
+                    success_count INTEGER NOT NULL DEFAULT 0,
+                    error_count INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS task_outcomes (
+                    run_id TEXT NOT NULL,
+                    account TEXT NOT NULL,
+                    success INTEGER NOT NULL,
+                    message TEXT,
+                    created_at TEXT,
+                    PRIMARY KEY (run_id, account)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS task_results (
+                    run_id TEXT NOT NULL,
+                    account TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (run_id, account)
+                )
+            """)
+
+    def try_start(self, task: str) -> Optional[str]:
+        """原子地把任务标记为运行中（compare-and-set），成功返回 run_id，已有运行中的任务返回 None
+        
+        启动成功时删除已不是任何任务最近一次运行的结果记录，结果表不会无限增长
+        """
+        run_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT OR IGNORE INTO task_state (task) VALUES (?)", (task,))
+            cursor = conn.execute("""
+                UPDATE task_state SET
+                    run_id = ?, is_running = 1, last_run = ?, finished_at = NULL, heartbeat = ?,
+                    total_accounts = 0, success_count = 0, error_count = 0
+                WHERE task = ? AND (is_running = 0 OR heartbeat < ?)
+            """, (run_id, time.strftime('%Y-%m-%d %H:%M:%S'), now, task, now - self.stale_after))
+            if cursor.rowcount != 1:
+                return None
+            for table in ("task_outcomes", "task_results"):
+                conn.execute(f"DELETE FROM {table} WHERE run_id NOT IN (SELECT run_id FROM task_state WHERE run_id IS NOT NULL)")
+        return run_id
+
+    def heartbeat(self, task: str, run_id: str):
+        """刷新心跳，表示任务所在进程仍在运行"""
+        self.increment(task, run_id)
+
+    def keep_alive(self, task: str, run_id: str, interval: float = 60) -> threading.Event:
+        """在后台线程中定期刷新心跳，直到返回的事件被 set（覆盖分配代理等不处理账号的阶段）"""
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(interval):
+                try:
+                    self.heartbeat(task, run_id)
+                except Exception as e:
+                    print(f"刷新任务心跳失败: {e}")
+
+        threading.Thread(target=beat, name=f"{task}-heartbeat", daemon=True).start()
+        return stop
+
+    def increment(self, task: str, run_id: str, **deltas: int):
+        """累加进度计数并刷新心跳"""
+        fields = [name for name in TASK_COUNTERS if deltas.get(name)]
+        assignments = "".join(f", {name} = {name} + ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE task_state SET heartbeat = ?{assignments} WHERE task = ? AND run_id = ?",
+                         (time.time(), *[deltas[name] for name in fields], task, run_id))
+
+    def record_outcome(self, run_id: str, account: str, success: bool, message: str = ""):
+        """记录单个账号的处理结果"""
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO task_outcomes (run_id, account, success, message, created_at) VALUES (?, ?, ?, ?, ?)",
+                         (run_id, account, int(success), message, time.strftime('%Y-%m-%d %H:%M:%S')))
+
+    def save_result(self, run_id: str, account: str, payload: Dict):
+        """保存账号的处理结果数据（如登录接口返回），供其他进程取用一次"""
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO task_results (run_id, account, payload, created_at) VALUES (?, ?, ?, ?)",
+                         (run_id, account, json.dumps(payload, ensure_ascii=False), time.time()))
+
+    def pop_result(self, run_id: str, max_age: float) -> Optional[Tuple[str, Dict]]:
+        """取出并删除某次运行中最早保存的结果数据，返回 (账号, 数据)；超过 max_age 秒的结果直接删除"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM task_results WHERE created_at < ?", (time.time() - max_age,))
+            row = conn.execute("SELECT account, payload FROM task_results WHERE run_id = ? ORDER BY created_at LIMIT 1",
+                               (run_id,)).fetchone()
+            if not row:
+                return None
+            cursor = conn.execute("DELETE FROM task_results WHERE run_id = ? AND account = ?", (run_id, row['account']))
+        # 多个进程同时取用时只有删除成功的一方拿到结果
+        return (row['account'], json.loads(row['payload'])) if cursor.rowcount == 1 else None
+
+    def finish(self, task: str, run_id: str):
+        """结束任务"""
+        with self._connect() as conn:
+            conn.execute("UPDATE task_state SET is_running = 0, finished_at = ? WHERE task = ? AND run_id = ?",
+                         (time.strftime('%Y-%m-%d %H:%M:%S'), task, run_id))
+
+    def get(self, task: str) -> Dict:
+        """读取任务状态"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM task_state WHERE task = ?", (task,)).fetchone()
+        if not row:
+            return {"run_id": None, "is_running": False, "last_run": None, "finished_at": None,
+                    "total_accounts": 0, "success_count": 0, "error_count": 0}
+        state = dict(row)
+        state['is_running'] = bool(state['is_running']) and state['heartbeat'] >= time.time() - self.stale_after
+        del state['task'], state['heartbeat']
+        return state
+
+    def get_outcomes(self, run_id: str) -> List[Dict]:
+        """读取某次运行中每个账号的结果"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT account, success, message, created_at FROM task_outcomes WHERE run_id = ? ORDER BY created_at",
+                                (run_id,)).fetchall()
+        return [dict(row, success=bool(row['success'])) for row in rows]
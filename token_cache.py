@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+登录token缓存
+按账号缓存登录token，在有效期内签到、查余额、提现直接复用，
+上游返回认证失败时立即失效。token 保存在状态数据库（SQLite）中，
+所有 gunicorn 进程共用，一个进程登录后其他进程直接复用，失效也对所有进程生效
+"""
+
+import hashlib
+import os
+import time
+from typing import Dict, Optional
+
+from status_store import SQLiteStore
+
+# 上游表示未登录/登录失效的返回码和提示（只匹配明确表示token失效的提示，避免误清有效token）
+AUTH_FAILURE_CODES = {401, 403}
+AUTH_FAILURE_KEYWORDS = ("请先登录", "请重新登录", "登录过期", "登录已过期", "登录失效", "未登录",
+                         "token无效", "token失效", "token过期", "token已过期", "无效的token",
+                         "invalid token", "token expired", "unauthenticated", "unauthorized")
+
+def is_auth_failure(data: Optional[Dict], status_code: Optional[int] = None) -> bool:
+    """判断接口返回是否为认证失败（token无效或过期）"""
+    if status_code in AUTH_FAILURE_CODES:
+        return True
+    if not isinstance(data, dict):
+        return False
+    if data.get('code') in AUTH_FAILURE_CODES:
+        return True
+    msg = str(data.get('msg', '')).lower()
+    return any(keyword in msg for keyword in AUTH_FAILURE_KEYWORDS)
+
+class TokenCache(SQLiteStore):
+    def __init__(self, db_file: str = "status.db", ttl: float = 3600):
+        """
+        Args:
+            db_file: SQLite 数据库文件
+            ttl: token缓存有效期（秒）
+        """
+        self.ttl = ttl
+        super().__init__(db_file)
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tokens (
+                    account TEXT PRIMARY KEY,
+                    token TEXT NOT NULL,
+                    password_hash TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+
+    @staticmethod
+    def _hash_password(password: str) -> str:
+        return hashlib.sha256(password.encode('utf-8')).hexdigest()
+
+    def get(self, account: str, password: Optional[str] = None) -> Optional[str]:
+        """获取有效token；传入密码时只有与缓存时的密码一致才返回"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT token, password_hash, expires_at FROM tokens WHERE account = ?",
+                               (account,)).fetchone()
+            if not row:
+                return None
+            if row['expires_at'] <= time.time():
+                conn.execute("DELETE FROM tokens WHERE account = ? AND expires_at <= ?", (account, time.time()))
+                return None
+        if password is not None and row['password_hash'] != self._hash_password(password):
+            return None
+        return row['token']
+
+    def set(self, account: str, token: str, password: str = "", ttl: Optional[float] = None):
+        """缓存账号token"""
+        expires_at = time.time() + (ttl if ttl is not None else self.ttl)
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO tokens (account, token, password_hash, expires_at) VALUES (?, ?, ?, ?)",
+                         (account, token, self._hash_password(password), expires_at))
+
+    def invalidate(self, account: str):
+        """使账号token失效"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM tokens WHERE account = ?", (account,))
+
+    def clear(self):
+        """清空缓存"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM tokens")
+
+# 全局token缓存实例（与账号状态使用同一个数据库）
+token_cache = TokenCache(os.getenv("STATUS_DB_FILE", "status.db"), ttl=float(os.getenv("TOKEN_TTL", "3600")))